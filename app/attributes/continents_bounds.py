@@ -29,3 +29,39 @@ continent_bounds = {
     }
 }
 
+
+# Finer rectangles, painted over continent_bounds in order (the last match wins), where the
+# continent boxes overlap or leave gaps. Borders are aligned to the quarter-degree region grid.
+continent_overrides = [
+    # North Africa coast, south of the Europe box
+    ("Africa", {"lat": (34.0, 36.0), "lon": (-18.0, -1.75)}),   # Morocco
+    ("Africa", {"lat": (34.0, 37.25), "lon": (-1.75, -1.25)}),  # western Algeria, south of Murcia
+    ("Africa", {"lat": (34.0, 37.5), "lon": (-1.25, 11.75)}),   # Algeria and Tunisia
+    # Anatolia, the Levant and the Caucasus, inside the Europe box
+    ("Asia", {"lat": (34.0, 41.0), "lon": (29.0, 60.0)}),
+    ("Europe", {"lat": (34.5, 35.75), "lon": (32.25, 34.75)}),  # Cyprus
+    ("Asia", {"lat": (37.25, 39.0), "lon": (27.0, 29.0)}),      # Izmir region
+    ("Asia", {"lat": (41.0, 50.0), "lon": (51.5, 60.0)}),       # east of the Caspian
+    # Middle East and the Arabian Peninsula, inside the Africa box (following the Red Sea)
+    ("Asia", {"lat": (29.5, 34.0), "lon": (34.25, 52.0)}),
+    ("Asia", {"lat": (25.0, 29.5), "lon": (35.25, 52.0)}),
+    ("Asia", {"lat": (21.75, 25.0), "lon": (37.5, 52.0)}),
+    ("Asia", {"lat": (20.0, 21.75), "lon": (38.75, 52.0)}),
+    ("Asia", {"lat": (16.0, 20.0), "lon": (40.5, 52.0)}),
+    ("Asia", {"lat": (12.5, 16.0), "lon": (42.75, 52.0)}),
+    # Northern coast of South America, inside the North America box
+    ("South America", {"lat": (7.0, 12.5), "lon": (-77.25, -52.0)}),
+    # Indonesia and Timor, south of the Asia box
+    ("Asia", {"lat": (-11.0, 1.0), "lon": (95.0, 141.0)}),
+    # Pacific islands east of the antimeridian
+    ("Oceania", {"lat": (-30.0, 0.0), "lon": (-180.0, -130.0)}),
+    # Greenland
+    ("North America", {"lat": (59.5, 83.75), "lon": (-52.0, -25.0)}),
+    ("North America", {"lat": (70.0, 83.75), "lon": (-25.0, -11.25)}),
+    # Atlantic and Indian ocean islands
+    ("Europe", {"lat": (36.5, 40.0), "lon": (-31.5, -24.75)}),     # Azores
+    ("Europe", {"lat": (32.25, 33.25), "lon": (-17.5, -16.0)}),    # Madeira
+    ("Europe", {"lat": (27.5, 29.5), "lon": (-18.25, -13.25)}),    # Canary Islands
+    ("Africa", {"lat": (14.0, 18.0), "lon": (-26.0, -22.0)}),      # Cape Verde
+    ("Africa", {"lat": (-35.0, 0.0), "lon": (52.0, 64.0)}),        # Mascarene Islands and Seychelles
+]
@@ -1,16 +1,124 @@
-from typing import List, Tuple, Dict
+from typing import Any, List, Optional, Tuple, Dict
 from app.schemas.Questionnaire import Answer, QuestionType
 from app.schemas.GenericTypes import GenericType, SPECIFIC_TO_GENERIC
 from enum import Enum
+import asyncio
 import json
+import logging
+import os
+import time
+import redis
 from pathlib import Path
-import requests as request 
+from app.utils.http_client import http_clients
+from app.utils.redis_utils import RedisCache, redis_cache
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # Diretório do script atual
 ATTRIBUTES_PATH = BASE_DIR / "attributes" / "attributes_answer.json"
 
+logger = logging.getLogger("uvicorn.error")
 
-def questionnaire_to_attributes(answers: List[Answer]) -> Tuple[List[str], List[str], Dict[str, float]]:
+# Seconds before the questions catalog is refreshed from user-management
+QUESTION_CATALOG_TTL = int(os.getenv("QUESTION_CATALOG_TTL", "600"))
+QUESTION_CATALOG_KEY = "questions:attributes_recommendations"
+# Minimum seconds between two refreshes forced by unknown questions
+QUESTION_CATALOG_FORCE_INTERVAL = int(os.getenv("QUESTION_CATALOG_FORCE_INTERVAL", "5"))
+
+
+class QuestionCatalog:
+    """
+    Process-local snapshot of the attributes_recommendations of every question in user-management.
+    A stale snapshot keeps being served while it is refreshed in the background, and the
+    last good snapshot is kept when user-management fails. Workers share the snapshot
+    through Redis, so only one of them has to call user-management per TTL.
+    """
+    def __init__(self, cache: RedisCache, ttl: int):
+        self.cache = cache
+        self.ttl = ttl
+        self._data: Optional[Dict[str, Any]] = None
+        self._fetched_at = 0.0
+        # last forced refresh attempt, failed ones included
+        self._forced_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._forced_refresh_task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at < self.ttl
+
+    async def get(self) -> Dict[str, Any]:
+        if self._data is None:
+            shared = await self._read_shared()
+            if shared is not None:
+                self._data, self._fetched_at = shared["data"], shared["fetched_at"]
+            else:
+                await self.refresh()
+        if not self._is_fresh(self._fetched_at) and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._data
+
+    async def get_with(self, question_ids: List[str]) -> Dict[str, Any]:
+        """
+        Like get, but refreshes the snapshot first if it lacks any of the questions
+        (e.g. added upstream after the snapshot). Concurrent misses share a single refresh,
+        and a refresh is forced at most once per QUESTION_CATALOG_FORCE_INTERVAL whether it
+        succeeded or not, so a failing user-management doesn't hold every request.
+        """
+        data = await self.get()
+        if all(question_id in data for question_id in question_ids):
+            return data
+        if self._forced_refresh_task is None or self._forced_refresh_task.done():
+            now = time.time()
+            if now - max(self._forced_at, self._fetched_at) < QUESTION_CATALOG_FORCE_INTERVAL:
+                return data
+            self._forced_at = now
+            logger.info(f"Questions missing from the catalog, refreshing it: {question_ids}")
+            self._forced_refresh_task = asyncio.create_task(self.refresh(force=True))
+        # shielded so a cancelled request doesn't cancel the refresh of the others
+        await asyncio.shield(self._forced_refresh_task)
+        return self._data
+
+    async def _read_shared(self) -> Optional[Dict[str, Any]]:
+        try:
+            cached = await self.cache.get(QUESTION_CATALOG_KEY)
+        except redis.RedisError as e:
+            logger.warning(f"Could not read the questions catalog from cache: {str(e)}")
+            return None
+        return json.loads(cached) if cached is not None else None
+
+    async def _write_shared(self, snapshot: Dict[str, Any]) -> None:
+        try:
+            # kept longer than the TTL so workers can fall back to it
+            await self.cache.set(QUESTION_CATALOG_KEY, json.dumps(snapshot), ttl=self.ttl * 24)
+        except redis.RedisError as e:
+            logger.warning(f"Could not write the questions catalog to cache: {str(e)}")
+
+    async def refresh(self, force: bool = False) -> None:
+        """Refreshes the snapshot, from the shared one while fresh unless forced"""
+        shared = await self._read_shared()
+        if not force and shared is not None and self._is_fresh(shared["fetched_at"]):
+            self._data, self._fetched_at = shared["data"], shared["fetched_at"]
+            return
+
+        try:
+            response = await http_clients.get("user-management", "/questions/")
+            response.raise_for_status()
+            data_response = response.json()
+        except Exception as e:
+            logger.warning(f"Could not refresh the questions catalog: {str(e)}")
+            # keep working with the last good snapshot, local or shared
+            if self._data is None and shared is not None:
+                self._data, self._fetched_at = shared["data"], shared["fetched_at"]
+            if self._data is None:
+                raise e
+            return
+
+        self._data = {str(q["id"]): q["attributes_recommendations"] for q in data_response}
+        self._fetched_at = time.time()
+        await self._write_shared({"fetched_at": self._fetched_at, "data": self._data})
+
+question_catalog = QuestionCatalog(redis_cache, QUESTION_CATALOG_TTL)
+
+
+async def questionnaire_to_attributes(answers: List[Answer]) -> Tuple[List[str], List[str], Dict[str, float]]:
     included_types: List[str] = []
     excluded_types: List[str] = []
     generic_type_scores: Dict[str, float] = {}
@@ -19,10 +127,8 @@ def questionnaire_to_attributes(answers: List[Answer]) -> Tuple[List[str], List[
     ignore_score_categories = [GenericType.FOOD, GenericType.SHOPPING, GenericType.TRANSPORTATION, GenericType.ACCOMMODATION, GenericType.NIGHTLIFE]
 
     try:
-        url = "http://user-management:8080/questions/"
-        response = request.get(url)
-        data_response=response.json()
-        data={str(q["id"]):q["attributes_recommendations"] for q in data_response}
+        # unknown questions force a refresh of the catalog
+        data = await question_catalog.get_with([str(ans.question_id) for ans in answers])
         for ans in answers:
             attrsIncluded, attrsExcluded, scores = answers_attributes(ans, data)
             included_types.extend(attrsIncluded)
@@ -2,18 +2,54 @@ from random import betavariate
 import typing
 from app.attributes import budget_dic
 from app.schemas.Activities import PlaceInfo, PriceRange,LatLong
-from typing import List,Dict,Set ,Tuple,Union
+from typing import List,Dict,Set ,Tuple,Union,Iterator
 from pathlib import Path
 from app.attributes.budget_dic import average_prices
-from app.attributes.continents_bounds import continent_bounds 
+from app.utils.region_index import region_index
+from app.handlers.ranking_handler import score_places, get_ranking_weights
 
 import json
+import os
+import time
+import numpy as np
 
 from app.schemas.Questionnaire import Place
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # Diretório do script atual
 TYPES_PATH = BASE_DIR / "attributes" / "generic_types.json"
 
+# Upper bound of type combinations whose inferred category is kept
+MAX_MEMOIZED_TYPE_SETS = 20000
+
+# price level -> (start_price, end_price) in dollars,
+# the end_price of VERY_EXPENSIVE just limits the range since this is essentially +100$
+PRICE_LEVEL_RANGES: Dict[str, Tuple[float, float]] = {
+    "FREE": (0.0, 0.0),
+    "INEXPENSIVE": (1.0, 15.0),
+    "MODERATE": (15.0, 40.0),
+    "EXPENSIVE": (40.0, 100.0),
+    "VERY_EXPENSIVE": (100.0, 200.0),
+}
+PRICE_LEVEL_CURRENCY = "$"
+PRICE_LEVEL_IDS: Dict[str, int] = {level: i for i, level in enumerate(PRICE_LEVEL_RANGES)}
+PRICE_LEVEL_STARTS = np.array([start for start, _ in PRICE_LEVEL_RANGES.values()])
+PRICE_LEVEL_ENDS = np.array([end for _, end in PRICE_LEVEL_RANGES.values()])
+
+# Categories whose places are free unless they state a price
+FREE_CATEGORIES = ("landmarks",)
+FREE_CATEGORY_IDS = [region_index.category_ids[category] for category in FREE_CATEGORIES]
+# Average prices are widened to a +/-10% range
+AVERAGE_PRICE_DEVIATION = 0.1
+
+# The budget can be exceeded by up to 15%
+BUDGET_TOLERANCE = 0.15
+# Price cells of the knapsack dynamic program, prices are rounded up to a cell
+KNAPSACK_RESOLUTION = int(os.getenv("KNAPSACK_RESOLUTION", "1000"))
+# Pools larger than this skip the dynamic program and use the greedy fallback
+KNAPSACK_MAX_ITEMS = int(os.getenv("KNAPSACK_MAX_ITEMS", "5000"))
+# Seconds the dynamic program may run before falling back to greedy
+KNAPSACK_TIME_LIMIT = float(os.getenv("KNAPSACK_TIME_LIMIT", "0.25"))
+
 
 class CategoryMatcher:
     def __init__(self, json_path: Path):
@@ -22,6 +58,18 @@ class CategoryMatcher:
             self.category_sets: Dict[str, Set[str]] = {
                 category: set(types) for category, types in self.category_map.items()
             }
+        # intern the type vocabulary to integer ids and keep each category as a row of a 0/1 matrix
+        self.categories: List[str] = list(self.category_sets)
+        self.type_ids: Dict[str, int] = {}
+        for types in self.category_sets.values():
+            for place_type in types:
+                self.type_ids.setdefault(place_type, len(self.type_ids))
+        self.category_matrix = np.zeros((len(self.categories), len(self.type_ids)))
+        for row, category in enumerate(self.categories):
+            self.category_matrix[row, [self.type_ids[t] for t in self.category_sets[category]]] = 1.0
+        self.category_sizes = self.category_matrix.sum(axis=1)
+        # place types -> inferred category
+        self._memo: Dict[Tuple[str, ...], str] = {}
 
     @staticmethod
     def jaccard_similarity(set1: Set[str], set2: Set[str]) -> float:
@@ -29,87 +77,243 @@ class CategoryMatcher:
         union = set1 | set2
         return len(intersection) / len(union) if union else 0.0
 
-    def infer_category(self, place_types: List[str]) -> str:
-        place_type_set = set(place_types)
-        best_match = None
-        best_score = -1.0
+    def _score_type_sets(self, type_sets: List[Tuple[str, ...]]) -> List[str]:
+        """
+        Scores many type sets against every category at once.
+        The intersections come from a single matrix product and ties keep
+        the first category, like comparing the Jaccard similarities one by one.
+        """
+        place_matrix = np.zeros((len(type_sets), len(self.type_ids)))
+        place_sizes = np.empty(len(type_sets))
+        rows, cols = [], []
+        for row, place_types in enumerate(type_sets):
+            place_type_set = set(place_types)
+            place_sizes[row] = len(place_type_set)
+            for place_type in place_type_set:
+                type_id = self.type_ids.get(place_type)
+                if type_id is not None:
+                    rows.append(row)
+                    cols.append(type_id)
+        place_matrix[rows, cols] = 1.0
 
-        for category, category_types in self.category_sets.items():
-            score = self.jaccard_similarity(place_type_set, category_types)
-            if score > best_score:
-                best_score = score
-                best_match = category
+        intersections = place_matrix @ self.category_matrix.T
+        unions = place_sizes[:, None] + self.category_sizes[None, :] - intersections
+        scores = np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+        return [self.categories[i] for i in scores.argmax(axis=1)]
 
-        return best_match
+    def infer_categories_from_types(self, types_per_place: List[List[str]]) -> List[str]:
+        """
+        Infers the best matching category of many places at once.
+        Places share a handful of type combinations, so the category of each combination
+        is memoized and only the unseen ones are scored.
+        """
+        keys = [tuple(place_types) for place_types in types_per_place]
+        unseen = list(dict.fromkeys(key for key in keys if key not in self._memo))
+        if unseen:
+            if len(self._memo) + len(unseen) > MAX_MEMOIZED_TYPE_SETS:
+                self._memo.clear()
+            self._memo.update(zip(unseen, self._score_type_sets(unseen)))
+        return [self._memo[key] for key in keys]
+
+    def infer_categories(self, places: List[PlaceInfo]) -> List[str]:
+        return self.infer_categories_from_types([place.types for place in places])
+
+    def infer_category(self, place_types: List[str]) -> str:
+        return self.infer_categories_from_types([place_types])[0]
 
 matcher=CategoryMatcher(TYPES_PATH)
 
+class PricedPool:
+    """
+    Price estimates of a pool of candidate places, kept as start price, end price
+    and currency arrays aligned with the places.
+    Iterating yields (PlaceInfo, PriceRange) pairs.
+    """
+    def __init__(
+        self,
+        places: List[PlaceInfo],
+        start_prices: np.ndarray,
+        end_prices: np.ndarray,
+        currencies: np.ndarray,
+        categories: List[str],
+    ):
+        self.places = places
+        self.start_prices = start_prices
+        self.end_prices = end_prices
+        self.currencies = currencies
+        # inferred category of each place, used to rank them
+        self.categories = categories
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def __iter__(self) -> Iterator[Tuple[PlaceInfo, PriceRange]]:
+        for i, place in enumerate(self.places):
+            yield place, self.price_range(i)
+
+    def price_range(self, i: int) -> PriceRange:
+        return PriceRange(
+            start_price=float(self.start_prices[i]),
+            end_price=float(self.end_prices[i]),
+            currency=str(self.currencies[i]),
+        )
+
 def get_continent_from_coords(cood:LatLong) -> str:
-    lat=cood.latitude
-    lon=cood.longitude
-    for continent, bounds in continent_bounds.items():
-        if bounds["lat"][0] <= lat <= bounds["lat"][1] and bounds["lon"][0] <= lon <= bounds["lon"][1]:
-            return continent
-    return "Unknown"
-
-
-def fit_places_on_price(prices:List[Tuple[PlaceInfo,PriceRange]],budget:int)->Tuple[List[PlaceInfo],PriceRange]:
-    places_inside_budget=[]
-    total_range=PriceRange(start_price=0.0,end_price=0.0,currency="")
-    factor=0.15
-    for (place,price) in prices:
-        if total_range.end_price + price.end_price < budget+ budget*factor:
-            total_range.start_price+=price.start_price
-            total_range.end_price+=price.end_price
-            total_range.currency=price.currency
-            places_inside_budget.append(place)
-
-    return places_inside_budget,total_range
-    
-
-def place_price(places:List[PlaceInfo])->List[Tuple[PlaceInfo,PriceRange]]:
-    place_price:List[Tuple[PlaceInfo,PriceRange]]=[]
-    for place in places:
-        continent=get_continent_from_coords(place.location)
-        currency=average_prices["cultural"][continent]["currency"]
+    return region_index.region_name(cood.latitude, cood.longitude)
+
+
+def ranking_values(prices:PricedPool)->np.ndarray:
+    """Ranking score of every place of the pool, among the places of the same category"""
+    values=np.zeros(len(prices))
+    by_category:Dict[str,List[int]]={}
+    for i,category in enumerate(prices.categories):
+        by_category.setdefault(category,[]).append(i)
+    for category,indices in by_category.items():
+        values[indices]=score_places([prices.places[i] for i in indices],get_ranking_weights(category))
+    return values
+
+
+def _greedy_selection(costs:np.ndarray,values:np.ndarray,capacity:float)->np.ndarray:
+    """Admits places by decreasing value per price while they fit, free places first"""
+    ratios=np.divide(values,costs,out=np.full(len(costs),np.inf),where=costs>0)
+    order=np.argsort(-ratios,kind="stable")
+    selected=np.zeros(len(costs),dtype=bool)
+    total=0.0
+    for i in order:
+        if costs[i]<=0 or total+costs[i]<=capacity:
+            total+=costs[i]
+            selected[i]=True
+    return selected
+
+
+def _knapsack_selection(costs:np.ndarray,values:np.ndarray,capacity:float,deadline:float)->Union[np.ndarray,None]:
+    """
+    0/1 knapsack maximizing the summed value, with prices rounded up to
+    KNAPSACK_RESOLUTION cells of the capacity so the selection never exceeds it.
+    Each place updates the whole value row at once.
+    Returns None when the deadline is reached.
+    """
+    selected=costs<=0
+    if capacity<=0:
+        return selected
+    cell=capacity/KNAPSACK_RESOLUTION
+    weights=np.ceil(costs/cell-1e-9).astype(np.int64)
+    items=np.flatnonzero((costs>0)&(weights<=KNAPSACK_RESOLUTION))
+
+    best=np.zeros(KNAPSACK_RESOLUTION+1)
+    taken=np.zeros((len(items),KNAPSACK_RESOLUTION+1),dtype=bool)
+    for k,i in enumerate(items):
+        if time.monotonic()>deadline:
+            return None
+        w=weights[i]
+        candidate=best[:-w]+values[i]
+        taken[k,w:]=candidate>best[w:]
+        best[w:]=np.maximum(best[w:],candidate)
+
+    cell_left=KNAPSACK_RESOLUTION
+    for k in range(len(items)-1,-1,-1):
+        if taken[k,cell_left]:
+            selected[items[k]]=True
+            cell_left-=weights[items[k]]
+    return selected
+
+
+def fit_places_on_price(
+    prices:PricedPool,
+    budget:int,
+    values:Union[np.ndarray,None]=None,
+    pinned_ids:Union[Set[str],None]=None,
+)->Tuple[List[PlaceInfo],PriceRange]:
+    """
+    Selects the places that maximize the summed ranking value while their end prices
+    stay under the budget (plus a 15% tolerance).
+    Pools up to KNAPSACK_MAX_ITEMS are solved exactly with a dynamic program over
+    discretized prices, larger pools or a dynamic program past KNAPSACK_TIME_LIMIT
+    fall back to a greedy selection by value per price.
+
+    Args:
+        prices: Priced pool of candidate places
+        budget: Budget of the trip
+        values: Value of each place of the pool, defaults to its ranking score in its category
+        pinned_ids: Ids of places that are always kept (e.g. must visit places), their price is paid first
+
+    Returns:
+        The selected places, in pool order, and their total price range
+    """
+    costs=np.maximum(prices.end_prices,0.0)
+    if values is None:
+        values=ranking_values(prices)
+    pinned=np.array([place.id in pinned_ids for place in prices.places],dtype=bool) if pinned_ids else np.zeros(len(prices),dtype=bool)
+    capacity=budget+budget*BUDGET_TOLERANCE-costs[pinned].sum()
+
+    free_to_choose=np.flatnonzero(~pinned)
+    selection=None
+    if len(free_to_choose)<=KNAPSACK_MAX_ITEMS:
+        selection=_knapsack_selection(
+            costs[free_to_choose],values[free_to_choose],capacity,time.monotonic()+KNAPSACK_TIME_LIMIT
+        )
+    if selection is None:
+        selection=_greedy_selection(costs[free_to_choose],values[free_to_choose],capacity)
+    selected=pinned.copy()
+    selected[free_to_choose[selection]]=True
+
+    indices=np.flatnonzero(selected)
+    total_range=PriceRange(
+        start_price=float(prices.start_prices[indices].sum()),
+        end_price=float(prices.end_prices[indices].sum()),
+        currency=str(prices.currencies[indices[-1]]) if len(indices) else "",
+    )
+    return [prices.places[i] for i in indices],total_range
+
+
+def place_price(places:List[PlaceInfo])->PricedPool:
+    """
+    Estimates the price of a whole pool of candidate places in one pass.
+    Every place starts from the average price of its category on its continent
+    (landmarks are free), a known price level replaces it with the matching tier
+    and an explicit price range takes precedence over both.
+
+    Args:
+        places: Candidate places of the trip
+
+    Returns:
+        The priced pool, ordered cheapest first for the budget fitting (shortest job first)
+    """
+    n=len(places)
+    if n==0:
+        return PricedPool([],np.zeros(0),np.zeros(0),np.empty(0,dtype=object),[])
+
+    categories=matcher.infer_categories(places)
+    category_ids=np.fromiter((region_index.category_ids[c] for c in categories),dtype=np.int64,count=n)
+    region_ids=region_index.lookup_places(places)
+
+    # category/continent averages, regions without prices (Unknown, Antarctica) are 0
+    averages=region_index.average_prices[region_ids,category_ids]
+    averages[np.isin(category_ids,FREE_CATEGORY_IDS)]=0.0
+    start_prices=averages*(1-AVERAGE_PRICE_DEVIATION)
+    end_prices=averages*(1+AVERAGE_PRICE_DEVIATION)
+    currencies=region_index.currencies[region_ids]
+
+    level_ids=np.full(n,-1,dtype=np.int64)
+    explicit:List[int]=[]
+    for i,place in enumerate(places):
         if place.price_range is not None:
-            place_price.append((place,place.price_range)) 
-            continue
-        if place.price_level is not None:
-            price_level=place.price_level 
-            print(price_level)
-            if price_level=="FREE":
-                place_price.append((place,PriceRange(start_price=0.0,end_price=0.0,currency="$"))) 
-            elif price_level=="INEXPENSIVE":
-                place_price.append((place,PriceRange(start_price=1,end_price=15,currency="$"))) 
-            elif price_level=="MODERATE":
-                place_price.append((place,PriceRange(start_price=15,end_price=40,currency="$"))) 
-            elif price_level=="EXPENSIVE":
-                place_price.append((place,PriceRange(start_price=40,end_price=100,currency="$"))) 
-            elif price_level=="VERY_EXPENSIVE":
-                # here the end_price is just to limit the range since this is essentially +100$
-                place_price.append((place,PriceRange(start_price=100,end_price=200,currency="$"))) 
-            continue 
-        best_match_generic_type=matcher.infer_category(place.types)
-        free_types=('landmarks')
-        # get the currency
-        # Filter the free location attributes of places
-        if best_match_generic_type in free_types:
-            place_price.append((place,PriceRange(start_price=0,end_price=0,currency=currency)))
-            continue
-        if best_match_generic_type in average_prices.keys():
-            if continent == "Unknown":
-                place_price.append((place,PriceRange(start_price=0,end_price=0,currency=currency))) 
-            factor=0.1
-            value=average_prices[best_match_generic_type][continent]["price"]
-            deviation=value*factor
-            start_price=value-deviation 
-            end_price=value+deviation 
-            place_price.append((place,PriceRange(start_price=start_price,end_price=end_price,currency=currency)))
-    print([f"{p.name} -> {v}\n" for (p,v) in place_price])
-    # x is a (PlaceInfo,PriceRange) type, this is important for the SFJ (shortest job first), basically tries to couple the cheaper places before the rest
-    sorted(place_price,key=lambda x: x[1].start_price)
-    return place_price 
-    #option 1 get the price range from google (verify) 
-    #option 2 get the yelp prices by range
-    #option 3 get the mapping from json 
+            explicit.append(i)
+        elif place.price_level is not None:
+            level_ids[i]=PRICE_LEVEL_IDS.get(place.price_level,-1)
+
+    with_level=level_ids>=0
+    start_prices[with_level]=PRICE_LEVEL_STARTS[level_ids[with_level]]
+    end_prices[with_level]=PRICE_LEVEL_ENDS[level_ids[with_level]]
+    currencies[with_level]=PRICE_LEVEL_CURRENCY
+
+    for i in explicit:
+        price_range=places[i].price_range
+        start_prices[i]=price_range.start_price
+        end_prices[i]=price_range.end_price
+        currencies[i]=price_range.currency
+
+    order=np.argsort(start_prices,kind="stable")
+    return PricedPool(
+        [places[i] for i in order],start_prices[order],end_prices[order],currencies[order],[categories[i] for i in order]
+    )
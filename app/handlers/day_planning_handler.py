@@ -0,0 +1,219 @@
+from typing import List, Optional
+import numpy as np
+from app.schemas.Activities import Activity
+from app.utils.geo import distance_matrix, places_to_arrays
+
+# Assignment/update rounds of the day clustering
+DAY_CLUSTERING_ITERATIONS = 10
+# Upper bound of 2-opt improvements applied to the visiting order of a day
+TWO_OPT_MAX_ITERATIONS = 100
+
+
+def _initial_medoids(distances: np.ndarray, day_of: np.ndarray, pinned: np.ndarray, n_days: int) -> np.ndarray:
+    """
+    Days with pinned places start from one of them, the other days from the
+    places farthest from the medoids chosen so far
+    """
+    medoids = np.full(n_days, -1)
+    for d in range(n_days):
+        pinned_members = np.flatnonzero(pinned & (day_of == d))
+        if len(pinned_members):
+            medoids[d] = pinned_members[0]
+    for d in range(n_days):
+        if medoids[d] >= 0:
+            continue
+        chosen = medoids[medoids >= 0]
+        if len(chosen):
+            spread = distances[:, chosen].min(axis=1)
+        else:
+            spread = distances.sum(axis=1)
+        spread[chosen] = -1
+        medoids[d] = int(np.argmax(spread))
+    return medoids
+
+
+def _assign(
+    costs: np.ndarray,
+    groups: np.ndarray,
+    quotas: np.ndarray,
+    day_of: np.ndarray,
+    pinned: np.ndarray,
+) -> np.ndarray:
+    """Gives every free place to its closest medoid day that still has room for its group"""
+    assignment = np.where(pinned, day_of, -1)
+    for g in range(quotas.shape[1]):
+        members = np.flatnonzero((groups == g) & ~pinned)
+        if len(members) == 0:
+            continue
+        room = quotas[:, g].copy()
+        # (place, day) pairs by increasing distance to the medoid of the day
+        for flat in np.argsort(costs[members].ravel(), kind="stable"):
+            i, d = divmod(int(flat), costs.shape[1])
+            place = members[i]
+            if assignment[place] < 0 and room[d] > 0:
+                assignment[place] = d
+                room[d] -= 1
+    return assignment
+
+
+def balanced_day_clusters(
+    distances: np.ndarray,
+    groups: np.ndarray,
+    day_of: np.ndarray,
+    pinned: Optional[np.ndarray] = None,
+    max_iterations: int = DAY_CLUSTERING_ITERATIONS,
+) -> np.ndarray:
+    """
+    Balanced k-medoids over the places of a trip, one cluster per day.
+    Every day keeps as many places of each group (category) as it had in day_of,
+    and pinned places stay on their day.
+
+    Args:
+        distances: (n, n) distance matrix of the places
+        groups: Group id of each place
+        day_of: Initial day of each place
+        pinned: Places that can't change day
+
+    Returns:
+        The day of each place
+    """
+    n_days = int(day_of.max()) + 1 if len(day_of) else 0
+    if n_days < 2:
+        return day_of
+    if pinned is None:
+        pinned = np.zeros(len(day_of), dtype=bool)
+
+    n_groups = int(groups.max()) + 1
+    quotas = np.zeros((n_days, n_groups), dtype=np.int64)
+    np.add.at(quotas, (day_of[~pinned], groups[~pinned]), 1)
+
+    medoids = _initial_medoids(distances, day_of, pinned, n_days)
+    assignment = day_of
+    for _ in range(max_iterations):
+        new_assignment = _assign(distances[:, medoids], groups, quotas, day_of, pinned)
+        if np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        for d in range(n_days):
+            members = np.flatnonzero(assignment == d)
+            if len(members):
+                medoids[d] = members[int(np.argmin(distances[np.ix_(members, members)].sum(axis=1)))]
+    return assignment
+
+
+def cluster_days(
+    days_activities: List[List[Activity]],
+    days_groups: List[List[str]],
+    pinned_ids: Optional[set] = None,
+) -> List[List[Activity]]:
+    """
+    Regroups the activities of all days into geographically compact days,
+    keeping the number of activities of each group (category) of every day.
+
+    Args:
+        days_activities: Activities of each day
+        days_groups: Group (category) under which each activity was selected
+        pinned_ids: Ids of places that must stay on their day
+
+    Returns:
+        The activities of each day, in their previous relative order
+    """
+    activities = [a for day in days_activities for a in day]
+    if len(days_activities) < 2 or not activities:
+        return days_activities
+
+    group_names = [g for day in days_groups for g in day]
+    group_ids = {name: i for i, name in enumerate(dict.fromkeys(group_names))}
+    groups = np.array([group_ids[name] for name in group_names])
+    day_of = np.repeat(np.arange(len(days_activities)), [len(day) for day in days_activities])
+    pinned_ids = pinned_ids or set()
+    pinned = np.array([a.place.id in pinned_ids for a in activities], dtype=bool)
+
+    latitudes, longitudes = places_to_arrays([a.place for a in activities])
+    assignment = balanced_day_clusters(distance_matrix(latitudes, longitudes), groups, day_of, pinned)
+
+    clustered: List[List[Activity]] = [[] for _ in days_activities]
+    for activity, day in zip(activities, assignment):
+        clustered[day].append(activity)
+    return clustered
+
+
+def _nearest_neighbour_path(distances: np.ndarray, pinned: np.ndarray) -> np.ndarray:
+    """
+    Path through every place, pinned places keep their position and every other
+    position takes the free place nearest to the previous one
+    """
+    n = len(distances)
+    path = np.arange(n)
+    free = ~pinned.copy()
+    for position in range(n):
+        if pinned[position]:
+            continue
+        candidates = np.flatnonzero(free)
+        if position > 0:
+            nearest = candidates[int(np.argmin(distances[path[position - 1], candidates]))]
+        else:
+            # start at the free place farthest from the others, an end of the day
+            nearest = candidates[int(np.argmax(distances[np.ix_(candidates, candidates)].sum(axis=1)))]
+        path[position] = nearest
+        free[nearest] = False
+    return path
+
+
+def order_visits(
+    distances: np.ndarray,
+    pinned: Optional[np.ndarray] = None,
+    max_iterations: int = TWO_OPT_MAX_ITERATIONS,
+) -> np.ndarray:
+    """
+    Short visiting order (open path) of the places of a day: a nearest neighbour
+    path improved with 2-opt. Every segment reversal is evaluated at once and the
+    best one is applied, until none shortens the path. Pinned places keep their position.
+
+    Args:
+        distances: (n, n) distance matrix of the places
+        pinned: Places that keep their position
+
+    Returns:
+        The indices of the places in visiting order
+    """
+    n = len(distances)
+    if pinned is None:
+        pinned = np.zeros(n, dtype=bool)
+    if n < 3 or pinned.sum() >= n - 1:
+        return np.arange(n)
+
+    path = _nearest_neighbour_path(distances, pinned)
+    # a virtual endpoint at distance 0 from every place turns the open path into a cycle
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = distances
+    i, j = np.triu_indices(n, k=1)
+    i, j = i + 1, j + 1
+    # reversals including a pinned position would move it
+    pinned_before = np.concatenate(([0, 0], np.cumsum(pinned)))
+    allowed = pinned_before[j + 1] - pinned_before[i] == 0
+    i, j = i[allowed], j[allowed]
+    if len(i) == 0:
+        return path
+
+    for _ in range(max_iterations):
+        tour = np.concatenate(([n], path, [n]))
+        a, b, c, d = tour[i - 1], tour[i], tour[j], tour[j + 1]
+        deltas = padded[a, c] + padded[b, d] - padded[a, b] - padded[c, d]
+        best = int(np.argmin(deltas))
+        if deltas[best] >= -1e-9:
+            break
+        start, end = i[best] - 1, j[best] - 1
+        path[start:end + 1] = path[start:end + 1][::-1]
+    return path
+
+
+def order_day(activities: List[Activity], pinned_ids: Optional[set] = None) -> List[Activity]:
+    """Orders the activities of a day into a short route, pinned places keep their position"""
+    if len(activities) < 3:
+        return activities
+    pinned_ids = pinned_ids or set()
+    pinned = np.array([a.place.id in pinned_ids for a in activities], dtype=bool)
+    latitudes, longitudes = places_to_arrays([a.place for a in activities])
+    order = order_visits(distance_matrix(latitudes, longitudes), pinned)
+    return [activities[i] for i in order]
@@ -1,6 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
+from functools import partial
 from typing import List, Dict, Tuple, Optional, TypedDict, Set
+import asyncio
+import os
 import random
+import numpy as np
 from app.schemas.Activities import (
     ActivityType,
     TemplateType,
@@ -9,13 +15,17 @@ from app.schemas.Activities import (
     Activity,
     DayItinerary,
     TripItinerary,
-    get_activity_duration,
+    DEFAULT_ACTIVITY_DURATION,
+    add_worker_unknown_activity_types,
+    resolve_activity,
+    unknown_activity_type_counters,
 )
 from app.schemas.GenericTypes import GenericType, SPECIFIC_TO_GENERIC
 from app.schemas.ItineraryTypes import (
     TimeSlotActivityPair,
     create_timeslot_activity_pair,
 )
+from app.handlers.day_planning_handler import cluster_days, order_day
 from app.handlers.ranking_handler import (
     rank_places,
     rank_by_rating,
@@ -32,6 +42,18 @@ import logging
 
 logger = logging.getLogger("uvicorn.error")
 
+# Itineraries generated per trip, the greedy one plus candidates from perturbed rankings
+ITINERARY_CANDIDATES = int(os.getenv("ITINERARY_CANDIDATES", "4"))
+# Worker processes generating the candidates, 0 generates them in the request process (the default on single-core hosts)
+ITINERARY_WORKERS = int(os.getenv(
+    "ITINERARY_WORKERS",
+    str(min(ITINERARY_CANDIDATES, os.cpu_count() or 1) if (os.cpu_count() or 1) > 1 else 0),
+))
+# Standard deviation, in ranking positions, of the noise added to the rankings of a candidate
+CANDIDATE_RANK_JITTER = float(os.getenv("CANDIDATE_RANK_JITTER", "2"))
+
+_itinerary_executor: Optional[ProcessPoolExecutor] = None
+
 def get_activities_count(template_type: TemplateType) -> Dict[TimeSlot, int]:
     """Determine number of activities based on template type"""
     if template_type == TemplateType.LIGHT:
@@ -70,28 +92,26 @@ def filter_places_by_type(
     return filtered_places
 
 
+def resolve_place_activity(place: PlaceInfo) -> Tuple[ActivityType, int]:
+    """Determine the primary activity type of a place and its duration"""
+    activity = resolve_activity(place.types)
+    if activity is not None:
+        return activity
+    if place.types:
+        return ActivityType(place.types[0]), DEFAULT_ACTIVITY_DURATION
+
+    # Default to tourist_attraction or a common type that should be in all deployments
+    return ActivityType("tourist_attraction"), 60  # Default duration is 1 hour
+
+
 def determine_activity_duration(place: PlaceInfo) -> int:
     """Determine the duration for a specific place based on its primary type"""
-    for place_type in place.types:
-        try:
-            activity_type = ActivityType(place_type)
-            return get_activity_duration(activity_type)
-        except ValueError:
-            continue
-
-    return 60  # Default duration is 1 hour
+    return resolve_place_activity(place)[1]
 
 
 def get_activity_type(place: PlaceInfo) -> ActivityType:
     """Determine the primary activity type for a place"""
-    for place_type in place.types:
-        try:
-            return ActivityType(place_type)
-        except ValueError:
-            continue
-
-    # Default to tourist_attraction or a common type that should be in all deployments
-    return ActivityType("tourist_attraction")
+    return resolve_place_activity(place)[0]
 
 
 def distribute_activities_for_day(
@@ -299,17 +319,27 @@ def generate_itinerary(
     is_group: bool,
     template_type: TemplateType = TemplateType.MODERATE,
     must_visit_places: List[PlaceInfo] = [],
-    budget: float = None
+    budget: float = None,
+    seed: Optional[int] = None,
 ) -> TripItinerary:
-    """Generate a complete trip itinerary with improved landmark selection"""
+    """
+    Generate a complete trip itinerary with improved landmark selection.
+    With a seed the rankings are perturbed first, so each seed yields a different candidate.
+    """
 
     assert generic_type_scores, "Generic type scores are required"
 
+    if seed is not None:
+        places_by_generic_type = perturb_rankings(places_by_generic_type, seed)
+
     # number of activities for each day
     activities_count = get_activities_count(template_type)
     total_activities_per_day = sum(activities_count.values())
 
     days = []
+    # activities of every day and the group (category) each one was selected for
+    days_activities: List[List[Activity]] = []
+    days_groups: List[List[str]] = []
     current_date = start_date
     used_place_ids = set()
     activity_id = 0
@@ -330,6 +360,7 @@ def generate_itinerary(
 
         # Select places for the entire day
         day_activities = []
+        day_groups = []
         
         # If this is the first day and we have keyword places, make sure to include one
         if include_keyword_place and current_date.date() == start_date.date():
@@ -344,8 +375,7 @@ def generate_itinerary(
                 )
                 
                 # Add this place first
-                duration = determine_activity_duration(selected_keyword_place)
-                activity_type = get_activity_type(selected_keyword_place)
+                activity_type, duration = resolve_place_activity(selected_keyword_place)
                 
                 activity = Activity(
                     id=activity_id,
@@ -357,6 +387,7 @@ def generate_itinerary(
                 )
                 
                 day_activities.append(activity)
+                day_groups.append("keyword")
                 used_place_ids.add(selected_keyword_place.id)
                 activity_id += 1
                 
@@ -390,8 +421,10 @@ def generate_itinerary(
                     for place in selected_places:
                         if place in must_visit_places:
                             must_visit_places.remove(place)
-                        duration = determine_activity_duration(place)
-                        activity_type = get_activity_type(place)
+                            day_groups.append("must_visit")
+                        else:
+                            day_groups.append(category)
+                        activity_type, duration = resolve_place_activity(place)
                         activity = Activity(
                             id=activity_id,
                             place=place,
@@ -404,16 +437,10 @@ def generate_itinerary(
                         used_place_ids.add(place.id)
                         activity_id += 1
 
-        # Now assign these activities to time slots and reschedule them
         if day_activities:
-            time_slot_activities = assign_to_time_slots(
-                day_activities, activities_count
-            )
-            
-            day_itinerary.morning_activities = time_slot_activities[TimeSlot.MORNING]
-            day_itinerary.afternoon_activities = time_slot_activities[TimeSlot.AFTERNOON]
-            
             days.append(day_itinerary)
+            days_activities.append(day_activities)
+            days_groups.append(day_groups)
         
         current_date += timedelta(days=1)
 
@@ -421,6 +448,27 @@ def generate_itinerary(
         if len(used_place_ids) >= len(places):
             break
 
+    # Regroup the selected places into compact days, the keyword place stays on the first day
+    keyword_ids = {activity.place.id for day, groups in zip(days_activities, days_groups)
+                   for activity, group in zip(day, groups) if group == "keyword"}
+    must_visit_ids = {activity.place.id for day, groups in zip(days_activities, days_groups)
+                      for activity, group in zip(day, groups) if group == "must_visit"}
+    days_activities = cluster_days(days_activities, days_groups, pinned_ids=keyword_ids)
+
+    # Now assign these activities to time slots and reschedule them
+    for day_itinerary, day_activities in zip(days, days_activities):
+        # visit the places of the day in a short route, keyword and must visit places keep their position
+        day_activities = order_day(day_activities, pinned_ids=keyword_ids | must_visit_ids)
+        placeholder_time = datetime.combine(day_itinerary.date.date(), datetime.min.time())
+        for activity in day_activities:
+            activity.start_time = placeholder_time
+        time_slot_activities = assign_to_time_slots(
+            day_activities, activities_count
+        )
+        
+        day_itinerary.morning_activities = time_slot_activities[TimeSlot.MORNING]
+        day_itinerary.afternoon_activities = time_slot_activities[TimeSlot.AFTERNOON]
+
     return TripItinerary(
         start_date=start_date,
         end_date=end_date,
@@ -430,6 +478,113 @@ def generate_itinerary(
     )
 
 
+def perturb_rankings(
+    places_by_generic_type: Dict[str, List[PlaceInfo]],
+    seed: int,
+) -> Dict[str, List[PlaceInfo]]:
+    """Reorders every ranking by its positions plus gaussian noise, keeping it mostly rank-driven"""
+    rng = np.random.default_rng(seed)
+    perturbed = {}
+    for category, places in places_by_generic_type.items():
+        order = np.argsort(np.arange(len(places)) + rng.normal(0, CANDIDATE_RANK_JITTER, len(places)), kind="stable")
+        perturbed[category] = [places[i] for i in order]
+    return perturbed
+
+
+def get_itinerary_executor() -> Optional[ProcessPoolExecutor]:
+    global _itinerary_executor
+    if ITINERARY_WORKERS <= 0:
+        return None
+    if _itinerary_executor is None:
+        _itinerary_executor = ProcessPoolExecutor(max_workers=ITINERARY_WORKERS)
+    return _itinerary_executor
+
+
+def shutdown_itinerary_executor() -> None:
+    global _itinerary_executor
+    if _itinerary_executor is not None:
+        _itinerary_executor.shutdown(cancel_futures=True)
+        _itinerary_executor = None
+
+
+async def generate_candidate_itineraries(
+    places: List[PlaceInfo],
+    places_by_generic_type: Dict[str, List[PlaceInfo]],
+    start_date: datetime,
+    end_date: datetime,
+    generic_type_scores: Dict[str, float],
+    is_group: bool,
+    template_type: TemplateType = TemplateType.MODERATE,
+    must_visit_places: List[PlaceInfo] = [],
+    candidates: int = ITINERARY_CANDIDATES,
+) -> List[TripItinerary]:
+    """
+    Generates the greedy itinerary and candidates-1 itineraries from perturbed rankings.
+    The candidates are generated in parallel in the itinerary worker processes,
+    or one after the other when there are no workers.
+
+    Returns:
+        The candidate itineraries, the greedy one first
+    """
+    seeds = [None] + list(range(1, max(candidates, 1)))
+    generate = partial(
+        generate_itinerary,
+        places=places,
+        places_by_generic_type=places_by_generic_type,
+        start_date=start_date,
+        end_date=end_date,
+        generic_type_scores=generic_type_scores,
+        is_group=is_group,
+        template_type=template_type,
+    )
+
+    executor = get_itinerary_executor() if len(seeds) > 1 else None
+    if executor is not None:
+        loop = asyncio.get_running_loop()
+        # each worker receives the places once and generates a share of the seeds
+        seed_groups = [seeds[i::ITINERARY_WORKERS] for i in range(min(ITINERARY_WORKERS, len(seeds)))]
+        try:
+            groups = await asyncio.gather(*(
+                loop.run_in_executor(executor, partial(_generate_in_worker, generate, must_visit_places, group))
+                for group in seed_groups
+            ))
+        except BrokenProcessPool as e:
+            logger.warning(f"Itinerary workers failed, generating the candidates in process: {str(e)}")
+            shutdown_itinerary_executor()
+        else:
+            for _, unknown_types in groups:
+                add_worker_unknown_activity_types(unknown_types)
+            by_seed = {
+                seed: itinerary
+                for group, (itineraries, _) in zip(seed_groups, groups)
+                for seed, itinerary in zip(group, itineraries)
+            }
+            return [by_seed[seed] for seed in seeds]
+
+    return _generate_for_seeds(generate, must_visit_places, seeds)
+
+
+def _generate_for_seeds(
+    generate: partial,
+    must_visit_places: List[PlaceInfo],
+    seeds: List[Optional[int]],
+) -> List[TripItinerary]:
+    # generate_itinerary consumes the must visit places, each candidate gets its own list
+    return [generate(must_visit_places=list(must_visit_places), seed=seed) for seed in seeds]
+
+
+def _generate_in_worker(
+    generate: partial,
+    must_visit_places: List[PlaceInfo],
+    seeds: List[Optional[int]],
+) -> Tuple[List[TripItinerary], Dict[str, int]]:
+    # workers keep their own unknown activity type counters, their deltas go back with the itineraries
+    before = unknown_activity_type_counters()
+    itineraries = _generate_for_seeds(generate, must_visit_places, seeds)
+    after = unknown_activity_type_counters()
+    return itineraries, {counter: after[counter] - before[counter] for counter in after}
+
+
 def format_itinerary_response(itinerary: TripItinerary) -> List[Dict]:
     """Format itinerary into a list of places with start/end times"""
     formatted_places = []
@@ -0,0 +1,289 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+import os
+import random
+import time
+import numpy as np
+from app.schemas.Activities import Activity, DayItinerary, PlaceInfo, TemplateType, TimeSlot, TripItinerary
+from app.schemas.GenericTypes import SPECIFIC_TO_GENERIC
+from app.handlers.itinerary_handler import assign_to_time_slots, get_activities_count, resolve_place_activity
+from app.handlers.day_planning_handler import order_day
+from app.metrics.distance_metric import DistanceMetric, MIN_AREA_PLACES, penalize_small_days
+from app.models.scores import Score
+from app.utils.geo import distance_matrix, places_to_arrays, spherical_polygon_areas
+
+logger = logging.getLogger("uvicorn.error")
+
+# Default time budget of the optimizer for one trip
+OPTIMIZER_DEADLINE_MS = float(os.getenv("OPTIMIZER_DEADLINE_MS", "150"))
+# Top-ranked unused places of each category that can replace a scheduled place
+OPTIMIZER_REPLACE_CANDIDATES = int(os.getenv("OPTIMIZER_REPLACE_CANDIDATES", "20"))
+# The search stops early after this many moves in a row without improvement
+OPTIMIZER_MAX_STALL = 2000
+
+
+def place_generic_type(place: PlaceInfo, categories: Dict[str, List[PlaceInfo]]) -> Optional[str]:
+    """First generic type of the place that has a ranking"""
+    for place_type in place.types:
+        generic_type = SPECIFIC_TO_GENERIC.get(place_type)
+        if generic_type in categories:
+            return generic_type
+    return None
+
+
+class ItineraryOptimizer:
+    """
+    Anytime local search over the days of an itinerary.
+    Starting from the given itinerary, it tries to swap places between days, move a place
+    to another day and replace a place by an unused top-ranked place of the same category,
+    and keeps every change that improves the score.
+    Places are indices of a pool with precomputed coordinates and distances, and each
+    move only re-measures the days it touches.
+    Moves never make the day sizes more uneven nor take a day below 3 places,
+    so days can't be emptied to shrink the average area.
+    """
+    def __init__(
+        self,
+        itinerary: TripItinerary,
+        places_by_generic_type: Dict[str, List[PlaceInfo]],
+        score: Score,
+        template_type: TemplateType = TemplateType.MODERATE,
+        pinned_ids: Optional[Set[str]] = None,
+        seed: int = 0,
+    ):
+        # only the day area can be updated incrementally
+        unsupported = [m for _, m in score.scores if not isinstance(m, DistanceMetric)]
+        if unsupported:
+            raise ValueError(f"Metrics not supported by the optimizer: {unsupported}")
+        self.weight = sum(w for w, _ in score.scores)
+
+        self.itinerary = itinerary
+        self.activities_count = get_activities_count(template_type)
+        self.capacity = sum(self.activities_count.values())
+        self.rng = random.Random(seed)
+        pinned_ids = pinned_ids or set()
+
+        self.places: List[PlaceInfo] = []
+        self.activities: Dict[int, Activity] = {}
+        index_of: Dict[str, int] = {}
+
+        def add_place(place: PlaceInfo) -> int:
+            key = place.id or f"{place.location.latitude},{place.location.longitude}"
+            if key not in index_of:
+                index_of[key] = len(self.places)
+                self.places.append(place)
+            return index_of[key]
+
+        self.days: List[List[int]] = []
+        for day in itinerary.days:
+            day_indices = []
+            for activity in day.morning_activities + day.afternoon_activities:
+                i = add_place(activity.place)
+                self.activities[i] = activity
+                day_indices.append(i)
+            self.days.append(day_indices)
+
+        scheduled = {i for day in self.days for i in day}
+        # unused replacement candidates of every category of a scheduled place
+        self.replacements: Dict[str, List[int]] = {}
+        self.category: Dict[int, Optional[str]] = {}
+        for i in scheduled:
+            category = place_generic_type(self.places[i], places_by_generic_type)
+            self.category[i] = category
+            if category is not None and category not in self.replacements:
+                candidates = []
+                for place in places_by_generic_type[category]:
+                    if len(candidates) >= OPTIMIZER_REPLACE_CANDIDATES:
+                        break
+                    j = add_place(place)
+                    if j not in scheduled:
+                        self.category[j] = category
+                        candidates.append(j)
+                self.replacements[category] = candidates
+
+        self.pinned = np.array([
+            p.id in pinned_ids or bool(getattr(p, "keyword_match", False)) for p in self.places
+        ], dtype=bool)
+        self.in_use = np.zeros(len(self.places), dtype=bool)
+        self.in_use[list(scheduled)] = True
+        self.latitudes, self.longitudes = places_to_arrays(self.places)
+        self.distances = distance_matrix(self.latitudes, self.longitudes)
+        self.areas = np.array([self._area(day) for day in self.days])
+        self.current_score = self._score(self.days, self.areas)
+
+    def _area(self, day: List[int]) -> float:
+        if len(day) < 3:
+            return 0.0
+        return float(spherical_polygon_areas(self.latitudes[day][None, :], self.longitudes[day][None, :])[0])
+
+    def _score(self, days: List[List[int]], areas: np.ndarray) -> float:
+        # weighted average area of the days, as DistanceMetric measures it
+        if not days:
+            return 0.0
+        counts = np.array([len(day) for day in days])
+        effective = penalize_small_days(areas, counts, np.zeros(len(days), dtype=np.int64), 1)
+        return self.weight * float(effective.mean())
+
+    def _apply_if_better(self, changes: Dict[int, List[int]]) -> bool:
+        """Replaces some days if that improves the score, only the changed days are re-measured"""
+        days, areas = list(self.days), self.areas.copy()
+        for d, day in changes.items():
+            days[d] = day
+            areas[d] = self._area(day)
+        new_score = self._score(days, areas)
+        if new_score - self.current_score <= 1e-9:
+            return False
+        self.days, self.areas, self.current_score = days, areas, new_score
+        return True
+
+    def score(self) -> float:
+        return self.current_score
+
+    def _non_empty_days(self) -> List[int]:
+        return [d for d, day in enumerate(self.days) if day]
+
+    def _try_swap(self) -> bool:
+        non_empty = self._non_empty_days()
+        if len(non_empty) < 2:
+            return False
+        a, b = self.rng.sample(non_empty, 2)
+        i, j = self.rng.randrange(len(self.days[a])), self.rng.randrange(len(self.days[b]))
+        new_a, new_b = list(self.days[a]), list(self.days[b])
+        new_a[i], new_b[j] = self.days[b][j], self.days[a][i]
+        return self._apply_if_better({a: new_a, b: new_b})
+
+    def _try_move(self) -> bool:
+        # the source keeps enough places to enclose an area
+        sources = [d for d, day in enumerate(self.days) if len(day) > MIN_AREA_PLACES]
+        targets = [d for d, day in enumerate(self.days) if len(day) < self.capacity]
+        if not sources or not targets:
+            return False
+        a, b = self.rng.choice(sources), self.rng.choice(targets)
+        if a == b:
+            return False
+        # only from a larger day, so the day sizes never get more uneven
+        if len(self.days[a]) <= len(self.days[b]):
+            return False
+        new_a, new_b = list(self.days[a]), list(self.days[b])
+        new_b.insert(self.rng.randrange(len(new_b) + 1), new_a.pop(self.rng.randrange(len(new_a))))
+        return self._apply_if_better({a: new_a, b: new_b})
+
+    def _try_replace(self) -> bool:
+        non_empty = self._non_empty_days()
+        if not non_empty:
+            return False
+        a = self.rng.choice(non_empty)
+        i = self.rng.randrange(len(self.days[a]))
+        current = self.days[a][i]
+        category = self.category.get(current)
+        if self.pinned[current] or category is None:
+            return False
+        candidates = [j for j in self.replacements[category] if not self.in_use[j]]
+        if not candidates:
+            return False
+        # the candidate closest on average to the rest of the day
+        others = [p for k, p in enumerate(self.days[a]) if k != i]
+        if others:
+            replacement = candidates[int(np.argmin(self.distances[np.ix_(candidates, others)].mean(axis=1)))]
+        else:
+            replacement = self.rng.choice(candidates)
+        new_a = list(self.days[a])
+        new_a[i] = replacement
+        if not self._apply_if_better({a: new_a}):
+            return False
+        self.in_use[current], self.in_use[replacement] = False, True
+        activity = self.activities[current]
+        activity_type, duration = resolve_place_activity(self.places[replacement])
+        self.activities[replacement] = Activity(
+            id=activity.id,
+            place=self.places[replacement],
+            start_time=activity.start_time,
+            end_time=activity.end_time,
+            activity_type=activity_type,
+            duration=duration,
+        )
+        return True
+
+    def optimize(self, deadline_ms: float = OPTIMIZER_DEADLINE_MS) -> Tuple[TripItinerary, int]:
+        """
+        Improves the itinerary until the deadline or until no move improves it anymore.
+
+        Returns:
+            The optimized itinerary and the number of search iterations completed
+        """
+        deadline = time.perf_counter() + deadline_ms / 1000
+        moves = []
+        if len(self.days) > 1:
+            moves += [self._try_swap, self._try_move]
+        if any(self.replacements.values()):
+            moves.append(self._try_replace)
+
+        initial_score = self.score()
+        iterations, improvements, stall = 0, 0, 0
+        while moves and stall < OPTIMIZER_MAX_STALL and time.perf_counter() < deadline:
+            iterations += 1
+            if self.rng.choice(moves)():
+                improvements += 1
+                stall = 0
+            else:
+                stall += 1
+
+        logger.info(
+            f"Optimizer ran {iterations} iterations with {improvements} improvements, "
+            f"score {initial_score} -> {self.score()}"
+        )
+        return self._build_itinerary(), iterations
+
+    def _build_itinerary(self) -> TripItinerary:
+        pinned_ids = {self.places[i].id for i in np.flatnonzero(self.pinned) if self.places[i].id}
+        days = []
+        for day, day_indices in zip(self.itinerary.days, self.days):
+            placeholder_time = datetime.combine(day.date.date(), datetime.min.time())
+            day_activities = []
+            for i in day_indices:
+                activity = self.activities[i]
+                # moved activities take the date of their new day
+                activity.start_time = placeholder_time
+                day_activities.append(activity)
+            if day_activities:
+                # the changed days are visited in a short order again, pinned places keep their position
+                day_activities = order_day(day_activities, pinned_ids=pinned_ids)
+                time_slot_activities = assign_to_time_slots(day_activities, self.activities_count)
+            else:
+                time_slot_activities = {TimeSlot.MORNING: [], TimeSlot.AFTERNOON: []}
+            days.append(DayItinerary(
+                date=day.date,
+                morning_activities=time_slot_activities[TimeSlot.MORNING],
+                afternoon_activities=time_slot_activities[TimeSlot.AFTERNOON],
+                # the routes of the previous order no longer apply, the caller routes the itinerary
+                routes=None,
+            ))
+        self.itinerary.days = days
+        return self.itinerary
+
+
+def optimize_itinerary(
+    itinerary: TripItinerary,
+    places_by_generic_type: Dict[str, List[PlaceInfo]],
+    score: Score,
+    template_type: TemplateType = TemplateType.MODERATE,
+    pinned_ids: Optional[Set[str]] = None,
+    deadline_ms: float = OPTIMIZER_DEADLINE_MS,
+) -> Tuple[TripItinerary, int]:
+    """
+    Improves an itinerary with local search against the score until the deadline.
+
+    Args:
+        itinerary: Itinerary to improve, usually the greedy one
+        places_by_generic_type: Pre-ranked places of each category, the replacement candidates
+        score: Score to maximize
+        template_type: Template of the trip, bounds the number of places per day
+        pinned_ids: Ids of places that must stay in the itinerary (e.g. must visit places)
+        deadline_ms: Time budget in milliseconds
+
+    Returns:
+        The optimized itinerary and the number of search iterations completed
+    """
+    optimizer = ItineraryOptimizer(itinerary, places_by_generic_type, score, template_type, pinned_ids)
+    return optimizer.optimize(deadline_ms)
@@ -1,11 +1,18 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from app.schemas.Activities import PlaceInfo
 from app.schemas.GenericTypes import GENERIC_TYPE_MAPPING
-import requests as request
+from app.utils.http_client import http_clients
+import asyncio
 import logging
 import math
+import os
 logger = logging.getLogger("uvicorn.error")
 
+# Maximum number of place-type batches requested at the same time for one search
+PLACES_BATCH_CONCURRENCY = int(os.getenv("PLACES_BATCH_CONCURRENCY", "4"))
+# Maximum number of keyword text searches requested at the same time for one trip
+KEYWORD_SEARCH_CONCURRENCY = int(os.getenv("KEYWORD_SEARCH_CONCURRENCY", "16"))
+
 
 async def get_places_recommendations(
     latitude: float,
@@ -23,8 +30,6 @@ async def get_places_recommendations(
     print(f"Included types: {included_types}")
     excluded_types = place_types[1]
     print(f"Excluded types: {excluded_types}")
-    url = "http://place-wrapper:8080/places/"
-
     request_body = {
         "location": {
             "latitude": latitude,
@@ -34,7 +39,7 @@ async def get_places_recommendations(
         "includedTypes": included_types,
         "excludedTypes": excluded_types,
     }
-    response = request.post(url, json=request_body)
+    response = await http_clients.post("place-wrapper", "/places/", json=request_body)
     status = response.status_code
     if status == 200:
         responseBody = response.json()
@@ -76,10 +81,13 @@ async def get_places_recommendations_batched(
     excluded_types: List[str] = [],
     radius: int = 5000,  # 5km radius
     max_results: int = 20,
+    max_concurrency: int = PLACES_BATCH_CONCURRENCY,
 ) -> List[PlaceInfo]:
     """
     Get place recommendations by making multiple API requests with batches of place types.
     Each batch contains at most 50 types, with higher-priority types in smaller batches.
+    Batches are requested concurrently (at most max_concurrency at a time) and merged
+    in priority order, a failed batch is skipped unless every batch fails.
     
     Args:
         latitude: Latitude coordinate
@@ -88,6 +96,7 @@ async def get_places_recommendations_batched(
         excluded_types: List of place types to exclude
         radius: Search radius in meters
         max_results: Maximum number of results to return per batch
+        max_concurrency: Maximum number of batch requests in flight
         
     Returns:
         Combined list of place recommendations from all batches
@@ -99,25 +108,47 @@ async def get_places_recommendations_batched(
     logger.info(f"Excluded types: {excluded_types}")
     
     logger.info(f"Making requests for {len(place_types_batches)} batches of place types")
-    
-    for i, batch in enumerate(place_types_batches):
-        logger.info(f"Processing batch {i+1} with {len(batch)} place types")
-        
-        batch_places = await get_places_recommendations(
-            latitude=latitude,
-            longitude=longitude,
-            place_types=(batch, excluded_types),
-            radius=radius,
-            max_results=max_results
-        )
-        
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    errors: List[Exception] = []
+
+    async def fetch_batch(i: int, batch: List[str]) -> Tuple[int, Optional[List[PlaceInfo]]]:
+        async with semaphore:
+            logger.info(f"Processing batch {i+1} with {len(batch)} place types")
+            try:
+                batch_places = await get_places_recommendations(
+                    latitude=latitude,
+                    longitude=longitude,
+                    place_types=(batch, excluded_types),
+                    radius=radius,
+                    max_results=max_results
+                )
+            except Exception as e:
+                logger.error(f"Batch {i+1} failed: {str(e)}")
+                errors.append(e)
+                return i, None
         logger.info(f"Batch {i+1} returned {len(batch_places)} places")
-        
-        # Add only unique places to the result
-        for place in batch_places:
-            if place.id not in seen_place_ids:
-                all_places.append(place)
-                seen_place_ids.add(place.id)
+        return i, batch_places
+
+    # Batches arrive in any order, each one is merged as soon as all the
+    # higher-priority batches are merged, so the result stays deterministic
+    finished: Dict[int, Optional[List[PlaceInfo]]] = {}
+    next_batch = 0
+    for next_finished in asyncio.as_completed(
+        [fetch_batch(i, batch) for i, batch in enumerate(place_types_batches)]
+    ):
+        i, batch_places = await next_finished
+        finished[i] = batch_places
+        while next_batch in finished:
+            # Add only unique places to the result
+            for place in finished.pop(next_batch) or []:
+                if place.id not in seen_place_ids:
+                    all_places.append(place)
+                    seen_place_ids.add(place.id)
+            next_batch += 1
+
+    if place_types_batches and len(errors) == len(place_types_batches):
+        raise Exception(f"All {len(errors)} batches of place types failed") from errors[0]
     
     logger.info(f"Total unique places found across all batches: {len(all_places)}")
     return all_places
@@ -231,8 +262,6 @@ async def search_places_by_keyword(
     query = f"{keyword} in {place_name}"
     logger.info(f"Searching for places with query: {query}")
     
-    url = "http://place-wrapper:8080/places/text-search"
-    
     request_body = {
         "query": query,
         "location": {
@@ -242,7 +271,7 @@ async def search_places_by_keyword(
         "radius": radius,
     }
     
-    response = request.post(url, json=request_body)
+    response = await http_clients.post("place-wrapper", "/places/text-search", json=request_body)
     status = response.status_code
     
     if status == 200:
@@ -280,3 +309,75 @@ async def search_places_by_keyword(
     else:
         logger.error(f"Error response from place-wrapper: {response.text}")
         return []
+
+
+async def search_places_by_keywords(
+    keywords: List[str],
+    place_name: str,
+    latitude: float,
+    longitude: float,
+    radius: int = 5000,  # 5km radius
+    max_concurrency: int = KEYWORD_SEARCH_CONCURRENCY,
+) -> List[PlaceInfo]:
+    """
+    Search places for several keywords concurrently.
+    A failing keyword search is logged and contributes no places.
+
+    Args:
+        keywords: Keywords to search for
+        place_name: Name of the place to search in
+        latitude: Latitude coordinate
+        longitude: Longitude coordinate
+        radius: Search radius in meters
+        max_concurrency: Maximum number of keyword searches in flight
+
+    Returns:
+        Places matching the keywords, in keyword order and deduplicated by id
+    """
+    if not keywords:
+        return []
+
+    logger.info(f"Searching for places with {len(keywords)} keywords")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def search(keyword: str) -> List[PlaceInfo]:
+        async with semaphore:
+            try:
+                return await search_places_by_keyword(
+                    keyword=keyword,
+                    place_name=place_name,
+                    latitude=latitude,
+                    longitude=longitude,
+                    radius=radius
+                )
+            except Exception as e:
+                logger.error(f"Error searching for keyword '{keyword}': {str(e)}")
+                return []
+
+    keyword_results = await asyncio.gather(*(search(keyword) for keyword in keywords))
+    keyword_places = merge_places(*keyword_results)
+    logger.info(f"Found {len(keyword_places)} unique places from keywords search")
+    return keyword_places
+
+
+def merge_places(*place_lists: List[PlaceInfo]) -> List[PlaceInfo]:
+    """
+    Merges lists of places into one list deduplicated by place id, in first-seen order.
+    Duplicate records are combined into the first one: its missing fields are filled
+    from the later records and it keeps keyword_match if any of them matched a keyword.
+    """
+    merged: Dict[str, PlaceInfo] = {}
+    for places in place_lists:
+        for place in places:
+            existing = merged.get(place.id)
+            if existing is None:
+                merged[place.id] = place
+                continue
+            if existing is place:
+                continue
+            for field, value in place:
+                if value is not None and getattr(existing, field) is None:
+                    setattr(existing, field, value)
+            if place.keyword_match:
+                existing.keyword_match = True
+    return list(merged.values())
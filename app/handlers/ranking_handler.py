@@ -1,86 +1,110 @@
 from typing import List, Dict, Callable, Tuple, Set
+import numpy as np
 from app.schemas.Activities import PlaceInfo
 
+PRICE_ORDER: Dict[str, float] = {
+    "FREE": 0.0,
+    "INEXPENSIVE": 1.0,
+    "MODERATE": 2.0,
+    "EXPENSIVE": 3.0,
+    "VERY_EXPENSIVE": 4.0
+}
+
+LANDMARK_TYPES: Set[str] = {
+    "tourist_attraction",
+    "point_of_interest",
+    "establishment",
+    "landmark",
+    "natural_feature",
+    "museum",
+    "historic",
+    "monument",
+    "church",
+    "place_of_worship",
+    "park"
+}
+
+# Normalizes the accessibility score (assuming we know all possible options)
+MAX_ACCESSIBILITY_OPTIONS = 10
+
+
+def extract_ranking_features(places: List[PlaceInfo]) -> Dict[str, np.ndarray]:
+    """
+    Extracts every feature used by the ranking criteria in a single pass over the places.
+    Missing values are encoded so that an ascending/descending stable sort
+    reproduces the ordering of the individual rank_by_* functions.
+    """
+    n = len(places)
+    rating = np.full(n, -np.inf)
+    price = np.full(n, np.inf)
+    accessibility = np.zeros(n)
+    prominence = np.zeros(n)
+    landmark = np.zeros(n)
+
+    for i, place in enumerate(places):
+        if place.rating is not None:
+            rating[i] = place.rating
+        price[i] = PRICE_ORDER.get(place.price_level, np.inf)
+        if place.accessibility_options:
+            accessibility[i] = len(place.accessibility_options) / MAX_ACCESSIBILITY_OPTIONS
+        prominence[i] = getattr(place, 'user_ratings_total', 0) or 0
+        if place.types:
+            landmark[i] = len(set(place.types) & LANDMARK_TYPES) / len(LANDMARK_TYPES)
+
+    return {
+        "rating": rating,
+        "price": price,
+        "accessibility": accessibility,
+        "prominence": prominence,
+        "landmark": landmark,
+    }
+
+
+def _criterion_order(features: Dict[str, np.ndarray], feature: str, descending: bool) -> np.ndarray:
+    """Stable argsort of one feature, equivalent to sorted(..., reverse=descending)"""
+    keys = features[feature]
+    return np.argsort(-keys if descending else keys, kind="stable")
+
+
+def _rank_by_feature(places: List[PlaceInfo], feature: str, descending: bool) -> List[PlaceInfo]:
+    order = _criterion_order(extract_ranking_features(places), feature, descending)
+    return [places[i] for i in order]
+
+
 def rank_by_rating(places: List[PlaceInfo]) -> List[PlaceInfo]:
-    """Ranks places by their rating"""
-    # Filter out places without ratings and sort by rating
-    rated_places = [p for p in places if p.rating is not None]
-    unrated_places = [p for p in places if p.rating is None]
-    
-    # Sort rated places by rating in descending order
-    sorted_rated_places = sorted(rated_places, key=lambda x: x.rating, reverse=True)
-    
-    # Combine sorted rated places with unrated places
-    return sorted_rated_places + unrated_places
+    """Ranks places by their rating, places without rating go last"""
+    return _rank_by_feature(places, "rating", descending=True)
 
 def rank_by_price(places: List[PlaceInfo]) -> List[PlaceInfo]:
     """Ranks places by their price level"""
-    price_order = {
-        "FREE": 0.0,
-        "INEXPENSIVE": 1.0,
-        "MODERATE": 2.0,
-        "EXPENSIVE": 3.0,
-        "VERY_EXPENSIVE": 4.0
-    }
-
-    return sorted(
-        places,
-        key=lambda x: price_order.get(x.price_level, float('inf'))
-    )
+    return _rank_by_feature(places, "price", descending=False)
 
 def rank_by_accessibility(places: List[PlaceInfo]) -> List[PlaceInfo]:
     """Ranks places by their accessibility options"""
-    def get_accessibility_score(place: PlaceInfo) -> float:
-        if not place.accessibility_options:
-            return 0.0
-        
-        # Count the number of accessibility options
-        options_count = len(place.accessibility_options)
-        # Normalize by the maximum possible options (assuming we know all possible options)
-        max_options = 10  # This should be adjusted based on your actual maximum
-        return options_count / max_options
-    
-    return sorted(places, key=get_accessibility_score, reverse=True)
+    return _rank_by_feature(places, "accessibility", descending=True)
 
 def rank_by_prominence(places: List[PlaceInfo]) -> List[PlaceInfo]:
     """
-    Ranks places by their prominence/importance using user_ratings_total 
+    Ranks places by their prominence/importance using user_ratings_total
     as a proxy for popularity
     """
-    # Some places might not have user_ratings_total, default to 0
-    return sorted(
-        places, 
-        key=lambda x: getattr(x, 'user_ratings_total', 0) or 0, 
-        reverse=True
-    )
+    return _rank_by_feature(places, "prominence", descending=True)
 
 def rank_by_landmark_status(places: List[PlaceInfo]) -> List[PlaceInfo]:
     """
     Ranks places by whether they are major landmarks based on place types
     """
-    landmark_types = {
-        "tourist_attraction",
-        "point_of_interest",
-        "establishment",
-        "landmark",
-        "natural_feature",
-        "museum",
-        "historic",
-        "monument",
-        "church",
-        "place_of_worship",
-        "park"
-    }
-    
-    def get_landmark_score(place: PlaceInfo) -> float:
-        if not place.types:
-            return 0.0
-            
-        # Count how many landmark type categories this place matches
-        matching_types = set(place.types) & landmark_types
-        return len(matching_types) / len(landmark_types)
-    
-    return sorted(places, key=get_landmark_score, reverse=True)
+    return _rank_by_feature(places, "landmark", descending=True)
+
+
+# ranking function -> (feature, descending) used by the vectorized ranking engine
+RANKING_CRITERIA: Dict[Callable, Tuple[str, bool]] = {
+    rank_by_rating: ("rating", True),
+    rank_by_price: ("price", False),
+    rank_by_accessibility: ("accessibility", True),
+    rank_by_prominence: ("prominence", True),
+    rank_by_landmark_status: ("landmark", True),
+}
 
 def get_ranking_weights(generic_type: str) -> List[Tuple[Callable, float]]:
     """
@@ -114,6 +138,36 @@ def get_ranking_weights(generic_type: str) -> List[Tuple[Callable, float]]:
         (rank_by_price, 0.2)
     ]
 
+def score_places(
+    places: List[PlaceInfo],
+    rankings: List[Tuple[Callable[[List[PlaceInfo]], List[PlaceInfo]], float]]
+) -> np.ndarray:
+    """
+    Computes the weighted composite score of each place.
+    The features are extracted once, each criterion costs a single argsort and
+    the normalized rank positions are blended with the weights in one pass.
+    Ranking functions unknown to RANKING_CRITERIA are called once and their
+    ordering is used as is.
+    """
+    n = len(places)
+    if n == 0:
+        return np.zeros(0)
+
+    features = extract_ranking_features(places)
+    positions = np.empty((len(rankings), n))
+    for k, (ranking_fn, _) in enumerate(rankings):
+        if ranking_fn in RANKING_CRITERIA:
+            order = _criterion_order(features, *RANKING_CRITERIA[ranking_fn])
+        else:
+            index_of = {id(place): i for i, place in enumerate(places)}
+            order = np.array([index_of[id(place)] for place in ranking_fn(places)])
+        positions[k, order] = np.arange(n)
+
+    weights = np.array([weight for _, weight in rankings])
+    # Normalize rank to [0,1] and invert so higher rank = higher score
+    normalized_scores = 1.0 - (positions / n)
+    return (normalized_scores * weights[:, None]).sum(axis=0)
+
 def compose_rankings(
     rankings: List[Tuple[Callable[[List[PlaceInfo]], List[PlaceInfo]], float]]
 ) -> Callable[[List[PlaceInfo]], List[PlaceInfo]]:
@@ -121,10 +175,10 @@ def compose_rankings(
     Composes multiple ranking functions with their weights.
     Each ranking function should return a sorted list of places.
     Weights should sum to 1.0.
-    
+
     Args:
         rankings: List of tuples containing (ranking_function, weight)
-    
+
     Returns:
         A new ranking function that combines the input rankings
     """
@@ -132,29 +186,16 @@ def compose_rankings(
     total_weight = sum(weight for _, weight in rankings)
     if abs(total_weight - 1.0) > 0.0001:  # Allow for small floating point errors
         raise ValueError("Ranking weights must sum to 1.0")
-    
+
     def combined_ranking(places: List[PlaceInfo]) -> List[PlaceInfo]:
         if not places:
             return []
-            
-        # Calculate scores for each place based on all rankings
-        place_scores: Dict[str, float] = {}
-        
-        for place in places:
-            total_score = 0.0
-            for ranking_fn, weight in rankings:
-                # Get the rank of the place in this ranking's ordering
-                ranked_places = ranking_fn(places)
-                rank = ranked_places.index(place)
-                # Normalize rank to [0,1] and invert so higher rank = higher score
-                normalized_score = 1.0 - (rank / len(places))
-                total_score += normalized_score * weight
-            
-            place_scores[place.id] = total_score
-        
-        # Sort places by their total score
-        return sorted(places, key=lambda x: place_scores[x.id], reverse=True)
-    
+
+        scores = score_places(places, rankings)
+        # Sort places by their total score, ties keep their original order
+        order = np.argsort(-scores, kind="stable")
+        return [places[i] for i in order]
+
     return combined_ranking
 
 def rank_places(
@@ -164,7 +205,7 @@ def rank_places(
     """
     Rank a list of places using the specified ranking function
     """
-    return ranking_fn(places) 
+    return ranking_fn(places)
 
 def pre_rank_places_by_category(
     places_by_generic_type: Dict[str, List[PlaceInfo]]
@@ -174,10 +215,10 @@ def pre_rank_places_by_category(
     Returns a dictionary mapping each category to its pre-ranked list of places.
     """
     pre_ranked_places = {}
-    
+
     for category, places in places_by_generic_type.items():
         ranking_weights = get_ranking_weights(category)
         ranking_function = compose_rankings(ranking_weights)
         pre_ranked_places[category] = rank_places(places, ranking_function)
-    
-    return pre_ranked_places 
+
+    return pre_ranked_places
@@ -1,96 +1,53 @@
-from typing import List
-from fastapi import HTTPException
-from app.schemas.Activities import Activity
-from app.utils.redis_utils import redis_cache
+from typing import List, Optional
+from app.schemas.Activities import Activity, DayItinerary, PlaceInfo
 from app.schemas.GenericTypes import SPECIFIC_TO_GENERIC
-import json
-from app.schemas.Questionnaire import TripItinerary
-from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger("uvicorn.error")
 
-class PydanticJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        if isinstance(obj, timedelta):
-            return str(obj)
-        return super().default(obj)
 
-def regenerate_activity_handler(trip_id: str, activity_id: int, places: dict, itinerary: List[TripItinerary]):
-    def get_current_activity():
-        for day in itinerary.days:
-            for act in day.morning_activities + day.afternoon_activities:
-                if act.id == activity_id:
-                    return act
-        return None
+def find_activity(day: DayItinerary, activity_id) -> Optional[Activity]:
+    """Activity of the day with the given id, compared as strings to handle type mismatches"""
+    for act in day.morning_activities + day.afternoon_activities:
+        if str(act.id) == str(activity_id):
+            return act
+    return None
 
-    def get_activity_type(place):
-        for place_type in place.types:
-            if place_type in SPECIFIC_TO_GENERIC:
-                return SPECIFIC_TO_GENERIC[place_type]
-        return None
 
-    def get_used_place_ids():
-        used_ids = set()
-        for day in itinerary.days:
-            for act in day.morning_activities + day.afternoon_activities:
-                used_ids.add(act.place.id)
-        return used_ids
+def get_activity_type(place: PlaceInfo) -> Optional[str]:
+    """Generic type (category) of the first place type that has one"""
+    for place_type in place.types:
+        if place_type in SPECIFIC_TO_GENERIC:
+            return SPECIFIC_TO_GENERIC[place_type]
+    return None
 
-    def find_new_place(current_type, used_ids):
-        if current_type not in places:
-            return None
 
-        type_places = places[current_type]
-        available_places = [p for p in type_places if p.id not in used_ids]
+def replacement_categories(current_type: str, categories: List[str]) -> List[str]:
+    """
+    Categories to take a replacement place from, in order: the category of the
+    replaced place, then every other category as a fallback
+    """
+    if current_type not in categories:
+        return []
+    return [current_type] + [category for category in categories if category != current_type]
 
-        
-        if available_places:
-            return available_places[0]
-
-        for category in places.keys():
-            if category == current_type:
-                continue
-            available_places = [p for p in places[category] if p.id not in used_ids]
-            if available_places:
-                return available_places[0]
-        return None
-
-    def update_place_queue(current_place, current_type):
-        if current_type in places and current_place in places[current_type]:
-            type_places = places[current_type]
-            type_places.remove(current_place)
-            type_places.append(current_place)
-            places_dict = {
-                category: [place.dict() for place in places]
-                for category, places in places.items()
-            }
-            redis_cache.set(f"trip:{trip_id}:pre_ranked_places", json.dumps(places_dict, cls=PydanticJSONEncoder), ttl=604800)
-
-    current_activity = get_current_activity()
-    if not current_activity:
-        raise HTTPException(status_code=404, detail="Activity not found")
-
-    current_type = get_activity_type(current_activity.place)
-    if not current_type:
-        raise HTTPException(status_code=400, detail="Could not determine activity type")
-
-    used_place_ids = get_used_place_ids()
-    new_place = find_new_place(current_type, used_place_ids)
-
-    if not new_place:
-        raise HTTPException(status_code=400, detail="No alternative places available")
-
-    update_place_queue(current_activity.place, current_type)
 
+def replace_activity_place(activity: Activity, place: PlaceInfo) -> Activity:
+    """The activity with another place, in the same time slot"""
     return Activity(
-        id=current_activity.id,
-        place=new_place,
-        start_time=current_activity.start_time,
-        end_time=current_activity.end_time,
-        activity_type=current_activity.activity_type,
-        duration=current_activity.duration,
+        id=activity.id,
+        place=place,
+        start_time=activity.start_time,
+        end_time=activity.end_time,
+        activity_type=activity.activity_type,
+        duration=activity.duration,
     )
-    
\ No newline at end of file
+
+
+def replace_day_activity(day: DayItinerary, activity_id, new_activity: Activity) -> None:
+    """Replaces the activity with the given id in the day"""
+    for activities in (day.morning_activities, day.afternoon_activities):
+        for i, act in enumerate(activities):
+            if str(act.id) == str(activity_id):
+                activities[i] = new_activity
+                return
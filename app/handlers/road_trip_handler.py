@@ -5,9 +5,23 @@ import numpy as np
 import polyline as poly
 from scipy.signal import argrelextrema
 from app.utils.distance_funcs import calculate_distance_lat_long, calculate_vector
+from app.utils.geo import distances_to
+from app.handlers.places_handler import get_places_recommendations_batched
+import asyncio
+import logging
 import math
+import os
 import uuid
-import requests as request 
+from app.utils.http_client import http_clients
+
+logger = logging.getLogger("uvicorn.error")
+
+# Maximum number of road trip centers searched at the same time, shared by all requests
+ROAD_CENTERS_CONCURRENCY = int(os.getenv("ROAD_CENTERS_CONCURRENCY", "8"))
+# Seconds to wait for the places around a single center before leaving it empty
+ROAD_CENTER_TIMEOUT = float(os.getenv("ROAD_CENTER_TIMEOUT", "20"))
+
+_centers_semaphore = asyncio.Semaphore(ROAD_CENTERS_CONCURRENCY)
 
 def calculate_division_centers(origin_cood,destination_cood,polyline)-> Tuple[List[LatLong],int,int]:
         # reduces the resolution of points of the polyline, to reduce the number of points in the route
@@ -40,16 +54,50 @@ def calculate_division_centers(origin_cood,destination_cood,polyline)-> Tuple[Li
         # to collect all the centers of the circle present on the route and 
         centers=[]
         counter=1
-        for idx in inflection_points:
+        route_points=np.asarray(coordinates_route,dtype=float).reshape(-1,2)[inflection_points]
+        # converts to km since the radius is in the same unit 
+        dists_to_origin=distances_to(route_points[:,0],route_points[:,1],origin_cood.latitude,origin_cood.longitude)/1000
+        for (lat,lon),dist_to_origin in zip(route_points,dists_to_origin):
             # cast for future function implementation
-            p=LatLong(latitude=coordinates_route[idx][0],longitude=coordinates_route[idx][1])
-            # converts to km since the radius is in the same unit 
-            dist_to_origin=calculate_distance_lat_long(origin_cood,p)/1000
+            p=LatLong(latitude=float(lat),longitude=float(lon))
             if dist_to_origin>=counter*radius:
                 centers.append(p)
                 counter+=1
         return centers, radius,num_circles
 
+async def get_places_per_center(
+    centers: List[LatLong],
+    place_types_batches: List[List[str]],
+    excluded_types: List[str],
+    radius: int,
+) -> List[List[PlaceInfo]]:
+    """
+    Fetches the places around every center concurrently.
+    The result keeps the position of each center, a center whose search fails
+    or exceeds ROAD_CENTER_TIMEOUT gets an empty list.
+    """
+    async def fetch(i: int, center: LatLong) -> List[PlaceInfo]:
+        async with _centers_semaphore:
+            try:
+                return await asyncio.wait_for(
+                    get_places_recommendations_batched(
+                        latitude=center.latitude,
+                        longitude=center.longitude,
+                        place_types_batches=place_types_batches,
+                        excluded_types=excluded_types,
+                        radius=radius,
+                    ),
+                    timeout=ROAD_CENTER_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out getting places for center {i}")
+            except Exception as e:
+                # não recebeu nenhum local
+                logger.error(f"Error getting places for center {i}: {str(e)}")
+            return []
+
+    return list(await asyncio.gather(*(fetch(i, center) for i, center in enumerate(centers))))
+
 def choose_places_road(all_places:List[List[PlaceInfo]],centers :List[LatLong])->List[Stop]:
     vector_centers=[]  
     for i in range(len(centers)-1):
@@ -77,14 +125,13 @@ def choose_places_road(all_places:List[List[PlaceInfo]],centers :List[LatLong])-
     # create a the road trip on a single day on the moorning activities for structure simplicity 
     return places_to_visit
 
-def  create_route_stops(stops:List[Stop])->List[Route]:
+async def create_route_stops(stops:List[Stop])->List[Route]:
     # order the stops by index (order of passage)
     stops.sort(key=lambda s: s.index)
     polylines=[]
     for i in range(1, len(stops)):
         previous = stops[i - 1].place
         current = stops[i].place
-        url = "http://maps-wrapper:8080/maps"
         request_body = {
             "origin": (
                 previous.location.dict()
@@ -96,7 +143,7 @@ def  create_route_stops(stops:List[Stop])->List[Route]:
             ),
             "travelMode": "VEHICLE",
         }
-        response = request.post(url, json=request_body)
+        response = await http_clients.post("maps-wrapper", "/maps", json=request_body)
         for route in response.json()["routes"]:
             polylines.append(Route(**route))
     return polylines
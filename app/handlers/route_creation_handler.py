@@ -6,39 +6,62 @@ from app.schemas.Activities import (
     Route,
 )
 from app.models.scores import Score,Metric
-from app.metrics.distance_metric import DistanceMetric
-import requests as request
-from app.utils.distance_funcs import calculate_distance_lat_long
-from typing import List,Tuple
+from app.metrics.distance_metric import DistanceMetric, MIN_AREA_PLACES
+from app.utils.http_client import http_clients
+from app.utils.geo import consecutive_distances, places_to_arrays
+from app.utils.route_cache import route_leg_cache
+from typing import Dict,List,Tuple
+import asyncio
+import logging
+import os
+import numpy as np
 
+logger = logging.getLogger("uvicorn.error")
 
-def create_route_on_itinerary(itineraries: List[TripItinerary]) -> TripItinerary:
-    new_days: List[DayItinerary] = []
+# Maximum number of uncached legs requested to maps-wrapper at the same time
+ROUTE_LEGS_CONCURRENCY = int(os.getenv("ROUTE_LEGS_CONCURRENCY", "16"))
+_route_legs_semaphore = asyncio.Semaphore(ROUTE_LEGS_CONCURRENCY)
+# Extra attempts of a leg whose request to maps-wrapper failed, before it is left out
+ROUTE_LEG_RETRIES = int(os.getenv("ROUTE_LEG_RETRIES", "1"))
+
+
+def itinerary_score() -> Score:
+    """Score used to compare itineraries"""
     # the objective is to make a weights array before array based on the responses of the forms in order to give more or less importance to certain metrics 
-    weights=[1]
+    # the area covered by the days is a cost, the more compact the days the better
+    weights=[-1]
     metrics:List[Metric]=[DistanceMetric()]
-    score=Score(list(zip(weights,metrics)))
-    index_trip:int=-1
-    iter_max_score:float=0.0
-    iter_score:List[Tuple[TripItinerary,float]]=[]
-    # iterate over all the itineraries and make a evaluation based on metrics
-    for i,iter in enumerate(itineraries):
-        score_value=score.calculate_full_score(iter)
-        if index_trip==-1 or iter_max_score<score_value:
-            iter_max_score=score_value
-            index_trip=i
-        iter_score.append((iter,score_value))
-
-    choosen_itinerary:TripItinerary=itineraries[index_trip] 
+    return Score(list(zip(weights,metrics)))
+
+
+def select_best_itinerary(itineraries: List[TripItinerary]) -> TripItinerary:
+    """
+    Scores every itinerary at once and returns the highest-score one, the first one on ties.
+    Only the itineraries with the fewest days too small to enclose an area compete,
+    so emptying days into the others never wins.
+    """
+    scores=itinerary_score().calculate_batch(itineraries)
+    small_days=np.array([
+        sum(len(d.morning_activities)+len(d.afternoon_activities)<MIN_AREA_PLACES for d in itinerary.days)
+        for itinerary in itineraries
+    ])
+    scores=np.where(small_days==small_days.min(),scores,-np.inf)
+    return itineraries[int(np.argmax(scores))]
+
+
+async def create_route_on_itinerary(itineraries: List[TripItinerary]) -> TripItinerary:
+    new_days: List[DayItinerary] = []
+    choosen_itinerary:TripItinerary=select_best_itinerary(itineraries)
 
     days: List[DayItinerary] = choosen_itinerary.days
+    # resolve the legs of every day at once, only the uncached ones reach maps-wrapper
+    days_paths = [
+        [act.place for act in d.morning_activities + d.afternoon_activities]
+        for d in days
+    ]
+    days_polylines = await get_polylines_on_days(days_paths)
     for i, d in enumerate(days):
-        morning_places = [act.place for act in d.morning_activities]
-        noon_places = [act.place for act in d.afternoon_activities]
-        all_paths = []
-        all_paths.extend(morning_places)
-        all_paths.extend(noon_places)
-        polylines_duration_list = get_polylines_on_places(all_paths)
+        polylines_duration_list = days_polylines[i]
         new_day = DayItinerary(
             routes=polylines_duration_list,
             morning_activities=d.morning_activities,
@@ -50,27 +73,88 @@ def create_route_on_itinerary(itineraries: List[TripItinerary]) -> TripItinerary
     choosen_itinerary.days=new_days
     return choosen_itinerary
 
-def get_polylines_on_places(places: List[PlaceInfo],travelMode="WALK",activate=True) -> List[Route]:
-    polylines = []
+def place_cache_ref(place: PlaceInfo) -> str:
+    """Identifies the place of a leg endpoint, by id or by coordinates when it has no id"""
+    if place.id:
+        return place.id
+    return f"{place.location.latitude},{place.location.longitude}"
+
+def place_route_endpoint(place: PlaceInfo) -> dict:
+    return place.location.dict() if not place.id else {"place_id": place.id}
+
+def get_route_legs(places: List[PlaceInfo], travelMode="WALK", activate=True) -> List[Tuple[PlaceInfo, PlaceInfo, str]]:
+    """Splits the places into consecutive (origin, destination, travel mode) legs"""
     threshold=1600 # metros
-    for i in range(1, len(places)):
-        previous = places[i - 1]
-        current = places[i]
-        if calculate_distance_lat_long(previous.location,current.location) >= threshold and activate: 
-            travelMode="TRASIT"
-        url = "http://maps-wrapper:8080/maps"
-        request_body = {
-            "origin": (
-                previous.location.dict()
-                if not previous.id
-                else {"place_id": previous.id}
-            ),
-            "destination": (
-                current.location.dict() if not current.id else {"place_id": current.id}
-            ),
-            "travelMode": travelMode,
-        }
-        response = request.post(url, json=request_body)
-        for route in response.json()["routes"]:
-            polylines.append(Route(**route))
-    return polylines
+    if len(places) < 2:
+        return []
+    latitudes, longitudes = places_to_arrays(places)
+    # once a leg is longer than the threshold the remaining legs of the day keep the transit mode
+    far = consecutive_distances(latitudes, longitudes) >= threshold
+    transit = np.logical_or.accumulate(far) if activate else np.zeros(len(far), dtype=bool)
+    return [
+        (places[i - 1], places[i], "TRASIT" if transit[i - 1] else travelMode)
+        for i in range(1, len(places))
+    ]
+
+async def fetch_route_leg(origin: PlaceInfo, destination: PlaceInfo, travelMode: str) -> List[dict]:
+    request_body = {
+        "origin": place_route_endpoint(origin),
+        "destination": place_route_endpoint(destination),
+        "travelMode": travelMode,
+    }
+    async with _route_legs_semaphore:
+        response = await http_clients.post("maps-wrapper", "/maps", json=request_body)
+    if response.status_code != 200:
+        raise Exception(f"Error response from maps-wrapper: {response.text}")
+    return response.json()["routes"]
+
+async def get_polylines_on_days(days_places: List[List[PlaceInfo]], travelMode="WALK", activate=True) -> List[List[Route]]:
+    """
+    Gets the routes between consecutive places of several days.
+    Legs are looked up in the route leg cache and every miss is requested
+    to maps-wrapper concurrently, so the whole itinerary costs a single wave of requests.
+    Failed legs are retried, and left out of the routes if they keep failing.
+    """
+    days_legs = [get_route_legs(places, travelMode, activate) for places in days_places]
+    leg_keys: Dict[str, Tuple[PlaceInfo, PlaceInfo, str]] = {}
+    for legs in days_legs:
+        for origin, destination, mode in legs:
+            key = route_leg_cache.key(place_cache_ref(origin), place_cache_ref(destination), mode)
+            leg_keys[key] = (origin, destination, mode)
+
+    leg_routes = await route_leg_cache.get_many(list(leg_keys))
+    missing_keys = [key for key in leg_keys if key not in leg_routes]
+    fetched_routes: Dict[str, List[dict]] = {}
+    for _ in range(1 + ROUTE_LEG_RETRIES):
+        if not missing_keys:
+            break
+        fetched = await asyncio.gather(
+            *(fetch_route_leg(*leg_keys[key]) for key in missing_keys), return_exceptions=True
+        )
+        failed_keys = []
+        for key, routes in zip(missing_keys, fetched):
+            if isinstance(routes, Exception):
+                logger.warning(f"Could not get route leg {key}: {str(routes)}")
+                failed_keys.append(key)
+            else:
+                fetched_routes[key] = routes
+        missing_keys = failed_keys
+    if missing_keys:
+        logger.error(f"Leaving out {len(missing_keys)} route legs that kept failing")
+    if fetched_routes:
+        # only the legs that were fetched are cached
+        await route_leg_cache.set_many(fetched_routes)
+        leg_routes.update(fetched_routes)
+
+    days_polylines = []
+    for legs in days_legs:
+        polylines = []
+        for origin, destination, mode in legs:
+            key = route_leg_cache.key(place_cache_ref(origin), place_cache_ref(destination), mode)
+            for route in leg_routes.get(key, []):
+                polylines.append(Route(**route))
+        days_polylines.append(polylines)
+    return days_polylines
+
+async def get_polylines_on_places(places: List[PlaceInfo],travelMode="WALK",activate=True) -> List[Route]:
+    return (await get_polylines_on_days([places], travelMode, activate))[0]
@@ -1,9 +1,54 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import logging
+import os
 
 from app.routes import trip
+from app.handlers.attribute_handler import question_catalog
+from app.handlers.itinerary_handler import shutdown_itinerary_executor
+from app.schemas.Activities import unknown_activity_type_stats
+from app.utils.http_client import http_clients
+from app.utils.redis_utils import redis_cache
 
-app = FastAPI()
+logger = logging.getLogger("uvicorn.error")
+
+# Seconds between two logs of the unknown activity type counters, 0 only logs them at shutdown
+ACTIVITY_TYPE_STATS_INTERVAL = int(os.getenv("ACTIVITY_TYPE_STATS_INTERVAL", "3600"))
+
+
+def log_unknown_activity_types() -> None:
+    logger.info(f"Unknown activity types: {unknown_activity_type_stats()}")
+
+
+async def log_unknown_activity_types_periodically(interval: int) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        log_unknown_activity_types()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_clients.startup()
+    try:
+        await question_catalog.refresh()
+    except Exception as e:
+        # loaded on the first trip instead
+        logger.warning(f"Could not preload the questions catalog: {str(e)}")
+    stats_task = None
+    if ACTIVITY_TYPE_STATS_INTERVAL > 0:
+        stats_task = asyncio.create_task(log_unknown_activity_types_periodically(ACTIVITY_TYPE_STATS_INTERVAL))
+    yield
+    if stats_task is not None:
+        stats_task.cancel()
+    log_unknown_activity_types()
+    await http_clients.close()
+    await redis_cache.close()
+    shutdown_itinerary_executor()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.include_router(trip.router)
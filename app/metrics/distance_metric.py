@@ -1,77 +1,69 @@
 from app.models.scores import Metric
 from typing import List,Tuple
 from app.schemas.Activities import DayItinerary, PlaceInfo,TripItinerary,LatLong
-from app.utils.distance_funcs import R, calculate_distance_lat_long
+from app.utils.distance_funcs import calculate_distance_matrix
+from app.utils.geo import padded_rings, spherical_polygon_areas
 import numpy as np 
-import math
+
+# A day needs this many places to enclose an area
+MIN_AREA_PLACES=3
+
+
+def penalize_small_days(areas:np.ndarray,counts:np.ndarray,owners:np.ndarray,n_itineraries:int)->np.ndarray:
+    """
+    Days with fewer than MIN_AREA_PLACES places enclose no area, so they count as the largest
+    day of their itinerary instead: emptying a day into the others must not look compact.
+
+    Args:
+        areas: Area of each day
+        counts: Number of places of each day
+        owners: Itinerary of each day
+        n_itineraries: Number of itineraries
+    """
+    largest=np.zeros(n_itineraries)
+    np.maximum.at(largest,owners,areas)
+    return np.where(counts<MIN_AREA_PLACES,largest[owners],areas)
+
 
 class DistanceMetric(Metric):
     def __init__(self) -> None:
         super().__init__()
 
 
-    def convert_lat_long_to_3d(self,coordinates:LatLong)->Tuple[float,float,float]:
-        rad_theta=(coordinates.latitude * math.pi) / 180
-        rad_phi= (coordinates.longitude * math.pi) / 180
-
-        x = R *  math.cos(rad_phi)* math.sin(rad_theta)
-        y = R *  math.sin(rad_theta)* math.sin(rad_phi)
-        z= R * math.sin(rad_phi)
-        return (x,y,z)
-
-    def calculate_distance_matrix(self,places:List[PlaceInfo]):
-        distance_matrix=[[-1.0 for i in range(len(places))] for j in range(len(places))]
-        for c in range(len(places)):
-            for r in range(c,len(places)):
-                if r == c :
-                    continue
-                locationR:LatLong=places[r].location
-                locationC:LatLong=places[c].location
-                distance_matrix[r][c]=calculate_distance_lat_long(locationC,locationR)
-                # distance_matrix[c][r]=distance_matrix[r][c]
-        return distance_matrix
+    def calculate_distance_matrix(self,places:List[PlaceInfo],dtype:type=np.float64)->np.ndarray:
+        return calculate_distance_matrix(places,dtype=dtype)
 
     def calculate_area_of_places(self,coordinates:List[LatLong])->float:
-        assert(len(coordinates)>=3)
-        n=len(coordinates)
-        points=[]
-        vectors=[]
-        vector_normals=[]
-        angles=[]
-        #Convert all the points into 3d spheres coordinates
-        for c in coordinates:
-            points.append(self.convert_lat_long_to_3d(c))
-        #calculate vectors
-        for i in range(1,len(points)+1):
-            a=(i-1)%len(points)
-            b=(i)%len(points)
-            v= (points[b][0]-points[a][0], points[b][1]-points[a][1],points[b][2]-points[a][2])
-            vectors.append(v)
-        #calculate all the angles between all the vectors 
-        for vi in range(0,len(vectors)):
-            vA=list(vectors[vi-1])
-            vB=list(vectors[vi])
-            vector_normals.append(np.cross(vA,vB))
-        for ci in range(0,len(vector_normals)):
-            n1=vector_normals[ci-1] 
-            n2=vector_normals[ci]
-            angles.append(np.dot(n1,n2))
-        #calculate the area with SPA
-        surface_area = (np.sum(angles)-(n-2)*math.pi) * R
-        return surface_area
+        # area in square meters of the polygon visiting the places in order, 0 with fewer than 3 places
+        return float(self.calculate_areas([coordinates])[0])
 
-    def places_density_per_day(self,day:DayItinerary)->float:
-        activities=day.morning_activities+day.afternoon_activities
-        places = [a.place for a in activities]
-        coordinates=[p.location for p in places] 
-        area_covered_day= self.calculate_area_of_places(coordinates)
-        return area_covered_day 
+    def calculate_areas(self,polygons:List[List[LatLong]])->np.ndarray:
+        latitudes,longitudes,_=padded_rings(polygons)
+        return spherical_polygon_areas(latitudes,longitudes)
 
-    # this metric for now only calculates the average coverage area of the places of all days of an itinerary
-    def calculate(self, itinerary: TripItinerary) -> float:
-        density_of_places= [self.places_density_per_day(d) for d in itinerary.days]
-        return np.average(density_of_places)
+    def calculate_areas_and_counts(self,polygons:List[List[LatLong]])->Tuple[np.ndarray,np.ndarray]:
+        latitudes,longitudes,counts=padded_rings(polygons)
+        return spherical_polygon_areas(latitudes,longitudes),counts
 
+    @staticmethod
+    def day_coordinates(day:DayItinerary)->List[LatLong]:
+        activities=day.morning_activities+day.afternoon_activities
+        return [a.place.location for a in activities]
 
+    def places_density_per_day(self,day:DayItinerary)->float:
+        return self.calculate_area_of_places(self.day_coordinates(day))
 
+    # this metric for now only calculates the average coverage area of the places of all days of an itinerary,
+    # days too small to enclose an area count as the largest day of their itinerary
+    def calculate(self, itinerary: TripItinerary) -> float:
+        return float(self.calculate_batch([itinerary])[0])
 
+    def calculate_batch(self,itineraries:List[TripItinerary])->np.ndarray:
+        # the days of every itinerary are packed in a single tensor and measured at once
+        days_per_itinerary=np.array([len(itinerary.days) for itinerary in itineraries],dtype=np.int64)
+        areas,counts=self.calculate_areas_and_counts([self.day_coordinates(d) for itinerary in itineraries for d in itinerary.days])
+        owners=np.repeat(np.arange(len(itineraries)),days_per_itinerary)
+        areas=penalize_small_days(areas,counts,owners,len(itineraries))
+        totals=np.bincount(owners,weights=areas,minlength=len(itineraries))
+        # itineraries without days cover no area
+        return np.divide(totals,days_per_itinerary,out=np.zeros(len(itineraries)),where=days_per_itinerary>0)
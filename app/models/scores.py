@@ -1,6 +1,7 @@
 from app.schemas.Activities import TripItinerary
 from typing import List,Tuple
 from abc import ABC, abstractmethod
+import numpy as np
 
 class Metric(ABC):
     itinerary:TripItinerary
@@ -8,14 +9,24 @@ class Metric(ABC):
     def calculate(self,itinerary:TripItinerary)->float:
         pass
 
+    def calculate_batch(self,itineraries:List[TripItinerary])->np.ndarray:
+        # metrics able to evaluate many itineraries at once override this
+        return np.array([self.calculate(itinerary) for itinerary in itineraries],dtype=float)
+
 
 class Score:
     def __init__(self,metrics:List[Tuple[float,Metric]]) -> None:
-        self.scores:List[Tuple[float,Metric]]=[]
+        self.scores:List[Tuple[float,Metric]]=list(metrics)
     def add_metric(self,weight:float,metric:Metric):
         self.scores.append((weight,metric))
     def calculate_full_score(self,itinerary:TripItinerary)->float:
         return sum([w*m.calculate(itinerary)for (w,m) in self.scores])
+    def calculate_batch(self,itineraries:List[TripItinerary])->np.ndarray:
+        # weighted score of every itinerary, each metric evaluates all of them at once
+        total=np.zeros(len(itineraries))
+        for (w,m) in self.scores:
+            total+=w*m.calculate_batch(itineraries)
+        return total
 
 
 
@@ -8,12 +8,14 @@ from app.handlers.places_handler import (
     get_places_recommendations,
     batch_included_types_by_score,
     get_places_recommendations_batched,
-    search_places_by_keyword,
+    search_places_by_keywords,
+    merge_places,
 )
-from app.handlers.itinerary_handler import generate_itinerary 
-from app.handlers.route_creation_handler import create_route_on_itinerary, get_polylines_on_places
-from app.handlers.road_trip_handler import  choose_places_road, create_route_stops,calculate_division_centers
-from app.handlers.budget_handler import place_price, fit_places_on_price
+from app.handlers.itinerary_handler import generate_candidate_itineraries
+from app.handlers.route_creation_handler import create_route_on_itinerary, get_polylines_on_places, select_best_itinerary, itinerary_score
+from app.handlers.optimizer_handler import optimize_itinerary, OPTIMIZER_DEADLINE_MS
+from app.handlers.road_trip_handler import  choose_places_road, create_route_stops,calculate_division_centers,get_places_per_center
+from app.handlers.budget_handler import place_price, fit_places_on_price, PricedPool
 from typing import Dict, List,Tuple
 from app.utils.openai_integration import OpenAIAPI
 from app.schemas.GenericTypes import (
@@ -21,26 +23,24 @@ from app.schemas.GenericTypes import (
     SPECIFIC_TO_GENERIC,
     GENERIC_TYPE_MAPPING,
 )
+import asyncio
 import logging
 import os
-import json
-import requests
 from app.utils.redis_utils import redis_cache
+from app.utils.place_store import place_store
+from app.utils.trip_store import trip_store, edit_backoff, TRIP_EDIT_RETRIES
 from app.handlers.ranking_handler import pre_rank_places_by_category
-from app.handlers.regenerate_activity_handler import regenerate_activity_handler
+from app.handlers.regenerate_activity_handler import (
+    find_activity,
+    get_activity_type,
+    replace_activity_place,
+    replace_day_activity,
+    replacement_categories,
+)
 import uuid 
 
 logger = logging.getLogger("uvicorn.error")
 
-class PydanticJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        if isinstance(obj, timedelta):
-            return str(obj)
-        return super().default(obj)
-
-
 router = APIRouter(
     prefix="/trip",
     tags=["base"],
@@ -50,7 +50,7 @@ router = APIRouter(
 
 @router.post("/route")
 async def testing_endpoint(itinerary: List[TripItinerary]):
-    result = create_route_on_itinerary(itinerary)
+    result = await create_route_on_itinerary(itinerary)
     return {"response": result}
 
 
@@ -67,7 +67,7 @@ async def create_trip(trip_data: TripCreate):
         
         # List[str], List[str]
         # TODO: maybe remove excluded types - seems useless
-        _, _, generic_type_scores = questionnaire_to_attributes(trip_data.questionnaire)
+        _, _, generic_type_scores = await questionnaire_to_attributes(trip_data.questionnaire)
             
         template_type = TemplateType.MODERATE
 
@@ -85,68 +85,43 @@ async def create_trip(trip_data: TripCreate):
         api_key = os.getenv("OPENAI")
         api = OpenAIAPI(api_key)
 
-        def get_radius():
-            return api.generate_radius(data.place_name) * 1000
+        async def get_radius():
+            # the OpenAI call is blocking, keep it off the event loop
+            return await asyncio.to_thread(api.generate_radius, data.place_name) * 1000
 
         
         # api if trip type is place otherwise the data.radius passed  
-        radius = redis_cache.get_or_set(f"radius:{data.place_name}", get_radius) if TripType(trip_type) ==TripType.PLACE else data.radius
+        radius = await redis_cache.get_or_set(f"radius:{data.place_name}", get_radius) if TripType(trip_type) ==TripType.PLACE else data.radius
         must_places:List[PlaceInfo] | None =  trip_data.must_visit_places if "must_visit_places" in trip_data.model_dump() else None
 
 
         # Get latitude and longitude based on trip type
         latitude = data.coordinates.latitude if TripType(trip_type) == TripType.PLACE else data.center.latitude
         longitude = data.coordinates.longitude if TripType(trip_type) == TripType.PLACE else data.center.longitude
-        # Get places from recommendation service
-        places: List[PlaceInfo] = await get_places_recommendations_batched(
-            latitude=latitude,
-            longitude=longitude,
-            place_types_batches=place_types_batches,
-            excluded_types=excluded_types,
-            radius=radius,
+        # Get place name from trip data for the keywords search
+        place_name = data.place_name if TripType(trip_type) == TripType.PLACE else "this area"
+
+        # Get places from recommendation service and, if keywords were provided,
+        # search for places by keywords at the same time
+        type_places, keyword_places = await asyncio.gather(
+            get_places_recommendations_batched(
+                latitude=latitude,
+                longitude=longitude,
+                place_types_batches=place_types_batches,
+                excluded_types=excluded_types,
+                radius=radius,
+            ),
+            search_places_by_keywords(
+                keywords=trip_data.keywords,
+                place_name=place_name,
+                latitude=latitude,
+                longitude=longitude,
+                radius=radius,
+            ),
         )
 
-        # If keywords were provided, search for places by keywords
-        keyword_places: List[PlaceInfo] = []
-        if trip_data.keywords and len(trip_data.keywords) > 0:
-            logger.info(f"Searching for places with {len(trip_data.keywords)} keywords")
-            
-            # Get the place name from trip data
-            place_name = data.place_name if TripType(trip_type) == TripType.PLACE else "this area"
-            
-            # Search for each keyword
-            for keyword in trip_data.keywords:
-                try:
-                    keyword_results = await search_places_by_keyword(
-                        keyword=keyword,
-                        place_name=place_name,
-                        latitude=latitude,
-                        longitude=longitude,
-                        radius=radius
-                    )
-                    
-                    if keyword_results:
-                        logger.info(f"Found {len(keyword_results)} places for keyword '{keyword}'")
-                        keyword_places.extend(keyword_results)
-                except Exception as e:
-                    logger.error(f"Error searching for keyword '{keyword}': {str(e)}")
-            
-            # Deduplicate places by ID
-            seen_ids = set()
-            unique_keyword_places = []
-            
-            for place in keyword_places:
-                if place.id not in seen_ids:
-                    seen_ids.add(place.id)
-                    unique_keyword_places.append(place)
-            
-            logger.info(f"Found {len(unique_keyword_places)} unique places from keywords search")
-            
-            # Add keyword places to regular places
-            # We'll also mark these places as coming from a keyword search
-            for place in unique_keyword_places:
-                if place.id not in [p.id for p in places]:
-                    places.append(place)
+        # Add keyword places to regular places, places found by both keep the keyword match
+        places: List[PlaceInfo] = merge_places(type_places, keyword_places)
 
         # group places by generic type
         # {"cultural": [PlaceInfo, PlaceInfo], "outdoor": [PlaceInfo]}
@@ -174,11 +149,14 @@ async def create_trip(trip_data: TripCreate):
         # Parse strings to datetime objects
 
         # Calculate and associate price differences 
-        prices:List[Tuple[PlaceInfo,PriceRange]]=place_price(for_r)
+        prices:PricedPool=place_price(for_r)
         # Select the places to be inside the budget
-        new_places,total_range=fit_places_on_price(prices,int(trip_data.budget))
+        new_places,total_range=fit_places_on_price(
+            prices,int(trip_data.budget),pinned_ids={place.id for place in mvps}
+        )
 
-        itinerary: TripItinerary = generate_itinerary(
+        # generate several candidate itineraries in parallel and keep only the best one
+        candidate_itineraries: List[TripItinerary] = await generate_candidate_itineraries(
             places=new_places,
             places_by_generic_type=pre_ranked_places,
             start_date=trip_data.start_date,
@@ -188,8 +166,21 @@ async def create_trip(trip_data: TripCreate):
             must_visit_places=mvps,
             is_group=trip_data.is_group,
         )
+        itinerary: TripItinerary = select_best_itinerary(candidate_itineraries)
+        optimizer_iterations = None
+        if trip_data.optimize:
+            # CPU-bound, kept off the event loop
+            itinerary, optimizer_iterations = await asyncio.to_thread(
+                optimize_itinerary,
+                itinerary,
+                pre_ranked_places,
+                itinerary_score(),
+                template_type,
+                pinned_ids={place.id for place in mvps},
+                deadline_ms=trip_data.optimize_deadline_ms or OPTIMIZER_DEADLINE_MS,
+            )
         itinerary.name=trip_data.name
-        itinerary = api.generate_itinerary(itinerary)
+        itinerary = await api.generate_itinerary(itinerary)
 
         # Get all used place IDs from the itinerary
         used_place_ids = set()
@@ -203,22 +194,15 @@ async def create_trip(trip_data: TripCreate):
             for category, places in pre_ranked_places.items()
         }
 
-        # Store pre-ranked places in cache for future regeneration
-        # Convert PlaceInfo objects to dict for JSON serialization
-        pre_ranked_places_dict = {
-            category: [place.dict() for place in places]
-            for category, places in non_used_pre_ranked_places.items()
-        }
-        redis_cache.set(f"trip:{trip_id}:pre_ranked_places", json.dumps(pre_ranked_places_dict), ttl=604800)  # 7 days
+        # Store pre-ranked places in the shared place store for future regeneration,
+        # the trip only keeps their ids
+        pre_ranked_place_ids = await place_store.save(non_used_pre_ranked_places)
 
         #add price-range to itinerary
         itinerary.price_range=total_range
-        # temporary solution | in the future generate multiple itineraries
-        proposed_itineraries = [itinerary]
-
-
-        routed_choosen_itinerary: TripItinerary = create_route_on_itinerary(
-            proposed_itineraries
+        # only the chosen candidate is routed
+        routed_choosen_itinerary: TripItinerary = await create_route_on_itinerary(
+            [itinerary]
             )
 
         trip_response = TripResponse(
@@ -229,6 +213,7 @@ async def create_trip(trip_data: TripCreate):
             template_type=template_type,
             generic_type_scores=generic_type_scores,
             is_group=trip_data.is_group,
+            optimizer_iterations=optimizer_iterations,
         )
 
         # Update the cached trip response
@@ -245,9 +230,8 @@ async def create_trip(trip_data: TripCreate):
         if not hasattr(trip_response, 'id') or not trip_response.id:
             trip_response.id = trip_id
         
-        # Convert to dict and save to cache
-        trip_dict = trip_response.dict()
-        redis_cache.set(f"trip:{trip_id}:response", json.dumps(trip_dict, cls=PydanticJSONEncoder), ttl=604800)
+        # Save the trip day by day, with the pre-ranked place ids in the same transaction
+        await trip_store.save(trip_id, trip_response, pre_ranked_place_ids)
 
         return trip_response
 
@@ -266,7 +250,7 @@ async def create_trip(trip_data: TripCreate):
             destination_cood=dest_place.location
             centers,radius,_ = calculate_division_centers(origin_cood,destination_cood,data.polylines)
             # add the origin and destiantion
-            _, _, generic_type_scores = questionnaire_to_attributes(trip_data.questionnaire)
+            _, _, generic_type_scores = await questionnaire_to_attributes(trip_data.questionnaire)
 
             template_type = TemplateType.MODERATE
 
@@ -281,21 +265,13 @@ async def create_trip(trip_data: TripCreate):
             )
 
             
-            all_places:List[List[PlaceInfo]]=[]
-            for i in centers:
-                try:
-                    places: List[PlaceInfo] = await get_places_recommendations_batched(
-                        latitude=i.latitude,
-                        longitude=i.longitude,
-                        place_types_batches=place_types_batches,
-                        excluded_types=excluded_types,
-                        radius=radius*1000,
-                    )
-                    all_places.append(places)
-                except Exception as e:
-                    # não recebeu nenhum local
-                    logger.error(f"Error getting places: {str(e)}")
-                    continue
+            # places around each center, in the same order as the centers
+            all_places:List[List[PlaceInfo]]=await get_places_per_center(
+                centers,
+                place_types_batches=place_types_batches,
+                excluded_types=excluded_types,
+                radius=radius*1000,
+            )
         
             centers.insert(0,origin_cood)
             centers.append(destination_cood)
@@ -303,7 +279,7 @@ async def create_trip(trip_data: TripCreate):
             stops:List[Stop]=choose_places_road(all_places,centers) 
             stops.insert(0,Stop(id=str(uuid.uuid4()),index=0,place=origin_place)) 
             stops.append(Stop(id=str(uuid.uuid4()),index=len(stops),place=dest_place)) 
-            routes= create_route_stops(stops)
+            routes= await create_route_stops(stops)
             road:RoadItinerary= RoadItinerary(
                 name=trip_data.name,
                 routes=routes,
@@ -331,192 +307,124 @@ async def regenerate_activity(trip_id: str, activity: dict):
     activity_id = activity.get("activityId")
     logger.info(f"Regenerating activity {activity_id} for trip {trip_id}")
 
-    # get cached trip response
-    cached_trip = redis_cache.get(f"trip:{trip_id}:response")
-    if not cached_trip:
-        raise HTTPException(status_code=404, detail="Trip not found in cache")
-
+    edit = None
+    claimed = None
     try:
-        cached_data = json.loads(cached_trip)
-        # Ensure required fields exist
-        if "trip_type" not in cached_data:
-            cached_data["trip_type"] = "place"  # Default to place if missing
-            
-        if "template_type" not in cached_data:
-            cached_data["template_type"] = "moderate"
-            
-        if "id" not in cached_data:
-            cached_data["id"] = trip_id
-            
-        if "is_group" not in cached_data:
-            cached_data["is_group"] = False
-        
-        trip_response = TripResponse(**cached_data)
-        itinerary = trip_response.itinerary
-    except Exception as e:
-        logger.error(f"Error loading cached trip data: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Invalid trip data in cache: {str(e)}")
-
-    # get cached pre-ranked places
-    cached_pre_ranked_places = redis_cache.get(f"trip:{trip_id}:pre_ranked_places")
-    if not cached_pre_ranked_places:
-        raise HTTPException(status_code=404, detail="Pre-ranked places not found in cache")
-
-    pre_ranked_places_dict = json.loads(cached_pre_ranked_places)
-    pre_ranked_places = {
-        category: [PlaceInfo(**place_dict) for place_dict in places]
-        for category, places in pre_ranked_places_dict.items()
-    }
-
-    new_activity = regenerate_activity_handler(trip_id, activity_id, pre_ranked_places, itinerary)
-    print(new_activity.place.name)
-
-    # Update the activity in the itinerary
-    for day in itinerary.days:
-        for i, act in enumerate(day.morning_activities):
-            if act.id == activity_id:
-                day.morning_activities[i] = new_activity
-                break
-        for i, act in enumerate(day.afternoon_activities):
-            if act.id == activity_id:
-                day.afternoon_activities[i] = new_activity
-                break
-
-    # Recalculate routes for the day
-    day = next(d for d in itinerary.days if any(a.id == activity_id for a in d.morning_activities + d.afternoon_activities))
-    all_places = [act.place for act in day.morning_activities + day.afternoon_activities]
-    polylines_duration_list = get_polylines_on_places(all_places)
-    day.routes = polylines_duration_list
-
-    # Update the cached trip response
-    trip_response.itinerary = itinerary
-    
-    # Ensure all required fields are set before saving
-    if not hasattr(trip_response, 'trip_type') or not trip_response.trip_type:
-        trip_response.trip_type = "place"  # Default to place if missing
-        
-    if not hasattr(trip_response, 'template_type') or not trip_response.template_type:
-        trip_response.template_type = TemplateType.MODERATE
-    
-    
-    if not hasattr(trip_response, 'id') or not trip_response.id:
-        trip_response.id = trip_id
-    
-    # Convert to dict and save to cache
-    trip_dict = trip_response.dict()
-    redis_cache.set(f"trip:{trip_id}:response", json.dumps(trip_dict, cls=PydanticJSONEncoder), ttl=604800)
-
-    return {
-        "response": {
-            "itinerary": itinerary
-        }
-    }
+        for attempt in range(TRIP_EDIT_RETRIES):
+            # get only the day of the activity, with the categories of the place queues,
+            # and after a conflict only the day again
+            try:
+                if edit is None:
+                    edit = await trip_store.load_day(trip_id, activity_id, with_queues=True)
+                else:
+                    await edit_backoff(attempt)
+                    edit = await trip_store.reload_day(edit, activity_id)
+            except Exception as e:
+                logger.error(f"Error loading cached trip data: {str(e)}")
+                raise HTTPException(status_code=400, detail=f"Invalid trip data in cache: {str(e)}")
+            if edit is None:
+                raise HTTPException(status_code=404, detail="Trip not found in cache")
+            if edit.day is None:
+                raise HTTPException(status_code=404, detail="Activity not found")
+            if edit.categories is None:
+                raise HTTPException(status_code=404, detail="Pre-ranked places not found in cache")
+
+            day = edit.day
+            current_activity = find_activity(day, activity_id)
+            current_type = get_activity_type(current_activity.place)
+            if not current_type:
+                raise HTTPException(status_code=400, detail="Could not determine activity type")
+
+            # the next unused place of the category (or of any other one), claimed atomically
+            # once and kept across the attempts
+            if claimed is None:
+                claimed = await trip_store.claim_place(trip_id, replacement_categories(current_type, edit.categories))
+                if claimed is None:
+                    raise HTTPException(status_code=400, detail="No alternative places available")
+            new_place = claimed[1]
+
+            new_activity = replace_activity_place(current_activity, new_place)
+            replace_day_activity(day, activity_id, new_activity)
+
+            # Recalculate routes for the day
+            all_places = [act.place for act in day.morning_activities + day.afternoon_activities]
+            polylines_duration_list = await get_polylines_on_places(all_places)
+            day.routes = polylines_duration_list
+
+            # only the edited day is written back, if no other edit wrote it meanwhile
+            itinerary = await trip_store.save_day(
+                edit,
+                removed_place=(current_type, current_activity.place),
+                added_place_id=new_place.id,
+            )
+            if itinerary is not None:
+                logger.info(f"Activity {activity_id} regenerated with {new_place.name}")
+                return {
+                    "response": {
+                        "itinerary": itinerary
+                    }
+                }
+    except Exception:
+        if claimed is not None:
+            await trip_store.release_place(trip_id, claimed[0], claimed[1].id)
+        raise
+
+    if claimed is not None:
+        await trip_store.release_place(trip_id, claimed[0], claimed[1].id)
+    raise HTTPException(status_code=409, detail="The trip was edited concurrently, try again")
     
 
 @router.delete("/{trip_id}/delete-activity/{activity_id}")
 async def delete_activity(trip_id: str, activity_id: str):
     logger.info(f"Deleting activity {activity_id} for trip {trip_id}")
 
-    # get cached trip response
-    cached_trip = redis_cache.get(f"trip:{trip_id}:response")
-    if not cached_trip:
-        raise HTTPException(status_code=404, detail="Trip not found in cache")
-
-    try:
-        cached_data = json.loads(cached_trip)
-        # Ensure required fields exist
-        if "trip_type" not in cached_data:
-            cached_data["trip_type"] = "place"  # Default to place if missing
-        
-        if "template_type" not in cached_data:
-            cached_data["template_type"] = "moderate"
-            
-        if "id" not in cached_data:
-            cached_data["id"] = trip_id
-            
-        if "is_group" not in cached_data:
-            cached_data["is_group"] = False
-        
-        trip_response = TripResponse(**cached_data)
-        itinerary = trip_response.itinerary
-    except Exception as e:
-        logger.error(f"Error loading cached trip data: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Invalid trip data in cache: {str(e)}")
-
-    # Debug: Log all activity IDs to identify issues
-    all_ids = []
-    for day in itinerary.days:
-        for act in day.morning_activities:
-            all_ids.append(f"morning: {act.id} (type: {type(act.id).__name__})")
-        for act in day.afternoon_activities:
-            all_ids.append(f"afternoon: {act.id} (type: {type(act.id).__name__})")
-    
-    logger.info(f"Available activity IDs: {all_ids}")
-    logger.info(f"Looking for activity ID: {activity_id} (type: {type(activity_id).__name__})")
-
-    # Find and remove the activity from the itinerary
-    activity_found = False
-    affected_day = None
-    
-    for day in itinerary.days:
-        # Check morning activities
-        for i, act in enumerate(day.morning_activities):
-            # Try different comparisons to handle potential type mismatches
-            if str(act.id) == str(activity_id):
-                logger.info(f"Found activity {activity_id} in morning activities")
-                activity_found = True
-                affected_day = day
-                day.morning_activities.pop(i)
-                break
-        
-        if activity_found:
-            break
-            
-        # Check afternoon activities
-        for i, act in enumerate(day.afternoon_activities):
-            if str(act.id) == str(activity_id):
-                logger.info(f"Found activity {activity_id} in afternoon activities")
-                activity_found = True
-                affected_day = day
-                day.afternoon_activities.pop(i)
-                break
-        
-        if activity_found:
-            break
-    
-    if not activity_found:
-        raise HTTPException(status_code=404, detail=f"Activity with ID {activity_id} not found in itinerary")
-    
-    # Recalculate routes for the affected day
-    if affected_day:
+    edit = None
+    for attempt in range(TRIP_EDIT_RETRIES):
+        # get only the day of the activity
+        try:
+            if edit is None:
+                edit = await trip_store.load_day(trip_id, activity_id)
+            else:
+                await edit_backoff(attempt)
+                edit = await trip_store.reload_day(edit, activity_id)
+        except Exception as e:
+            logger.error(f"Error loading cached trip data: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid trip data in cache: {str(e)}")
+        if edit is None:
+            raise HTTPException(status_code=404, detail="Trip not found in cache")
+        if edit.day is None:
+            raise HTTPException(status_code=404, detail=f"Activity with ID {activity_id} not found in itinerary")
+
+        # Remove the activity from its day
+        affected_day = edit.day
+        removed_place = None
+        for slot, activities in (("morning", affected_day.morning_activities), ("afternoon", affected_day.afternoon_activities)):
+            for i, act in enumerate(activities):
+                # Try different comparisons to handle potential type mismatches
+                if str(act.id) == str(activity_id):
+                    logger.info(f"Found activity {activity_id} in {slot} activities")
+                    removed_place = activities.pop(i).place
+                    break
+
+        # Recalculate routes for the affected day
         all_places = [act.place for act in affected_day.morning_activities + affected_day.afternoon_activities]
         if len(all_places) > 1:  # Only recalculate if there are at least 2 places
-            polylines_duration_list = get_polylines_on_places(all_places)
+            polylines_duration_list = await get_polylines_on_places(all_places)
             affected_day.routes = polylines_duration_list
         else:
             affected_day.routes = []  # No routes needed if 0 or 1 place
-    
-    # Update the cached trip response
-    trip_response.itinerary = itinerary
-    
-    # Ensure all required fields are set before saving
-    if not hasattr(trip_response, 'trip_type') or not trip_response.trip_type:
-        trip_response.trip_type = "place"  # Default to place if missing
-        
-    if not hasattr(trip_response, 'template_type') or not trip_response.template_type:
-        trip_response.template_type = TemplateType.MODERATE
-    
-    
-    if not hasattr(trip_response, 'id') or not trip_response.id:
-        trip_response.id = trip_id
-    
-    # Convert to dict and save to cache
-    trip_dict = trip_response.dict()
-    redis_cache.set(f"trip:{trip_id}:response", json.dumps(trip_dict, cls=PydanticJSONEncoder), ttl=604800)
-
-    return {
-        "response": {
-            "itinerary": itinerary
-        }
-    }
 
+        # only the affected day is written back, if no other edit wrote it meanwhile
+        itinerary = await trip_store.save_day(
+            edit,
+            removed_activity_ids=[activity_id],
+            removed_place=(None, removed_place),
+        )
+        if itinerary is not None:
+            return {
+                "response": {
+                    "itinerary": itinerary
+                }
+            }
+
+    raise HTTPException(status_code=409, detail="The trip was edited concurrently, try again")
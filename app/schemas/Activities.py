@@ -1,9 +1,12 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Mapping, Optional, Tuple
 from enum import Enum
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from types import MappingProxyType
 from pydantic import BaseModel, root_validator
 import json
 import os
+import sys
 
 
 def load_activity_types():
@@ -13,29 +16,92 @@ def load_activity_types():
 
 
 _activity_data = load_activity_types()
-_activity_types = list(_activity_data.get("durations", {}).keys())
+_activity_durations: Dict[str, int] = _activity_data.get("durations", {})
+_activity_types = list(_activity_durations.keys())
 
 ActivityType = Enum(
     "ActivityType", {k.upper().replace("-", "_"): k for k in _activity_types}, type=str
 )
 
 
+# Upper bound of unknown place types kept as ActivityType pseudo-members
+MAX_UNKNOWN_ACTIVITY_TYPES = int(os.getenv("MAX_UNKNOWN_ACTIVITY_TYPES", "1024"))
+
+_unknown_activity_types: "OrderedDict[str, ActivityType]" = OrderedDict()
+_unknown_activity_type_counters = {"seen": 0, "created": 0, "evicted": 0}
+# Counters of the itinerary worker processes, summed over the deltas they report back
+_worker_unknown_activity_type_counters = {"seen": 0, "created": 0, "evicted": 0}
+
+
 # handle missing values
 def _missing_(cls, value):
-    """Handle missing enum values by creating them on the fly"""
-    # Create a new enum member with the given value
-    # Convert to uppercase and replace dashes with underscores for the name
-    name = str(value).upper().replace("-", "_")
+    """
+    Handle missing enum values by creating them on the fly.
+    They are kept in a bounded LRU registry instead of the enum's _value2member_map_,
+    so arbitrary Google place types do not grow the enum for the life of the worker.
+    """
+    _unknown_activity_type_counters["seen"] += 1
+    member = _unknown_activity_types.get(value)
+    if member is not None:
+        _unknown_activity_types.move_to_end(value)
+        return member
+
+    value = sys.intern(str(value))
     member = str.__new__(cls, value)
-    member._name_ = name
+    # Convert to uppercase and replace dashes with underscores for the name
+    member._name_ = value.upper().replace("-", "_")
     member._value_ = value
-    # Add it to the enum class
-    cls._value2member_map_[value] = member
+    _unknown_activity_types[value] = member
+    _unknown_activity_type_counters["created"] += 1
+    if len(_unknown_activity_types) > MAX_UNKNOWN_ACTIVITY_TYPES:
+        _unknown_activity_types.popitem(last=False)
+        _unknown_activity_type_counters["evicted"] += 1
     return member
 
 
+def unknown_activity_type_counters() -> Dict[str, int]:
+    """Counters of this process alone, for the worker processes to report their deltas"""
+    return dict(_unknown_activity_type_counters)
+
+
+def add_worker_unknown_activity_types(delta: Dict[str, int]) -> None:
+    """Adds the counters a worker process reported to the workers' totals"""
+    for counter, value in delta.items():
+        _worker_unknown_activity_type_counters[counter] += value
+
+
+def unknown_activity_type_stats() -> Dict:
+    """
+    Counters of the place types resolved outside of activity_types.json: this process's,
+    with the size of its registry, and the totals of the itinerary worker processes
+    (each worker keeps its own registry, bounded alike).
+    """
+    return {
+        **_unknown_activity_type_counters,
+        "registered": len(_unknown_activity_types),
+        "workers": dict(_worker_unknown_activity_type_counters),
+    }
+
+
 ActivityType._missing_ = classmethod(_missing_)
 
+DEFAULT_ACTIVITY_DURATION = 90
+
+# Specific place type -> (ActivityType, duration in minutes), built once at import
+ACTIVITY_TABLE: Mapping[str, Tuple[ActivityType, int]] = MappingProxyType({
+    place_type: (ActivityType(place_type), duration)
+    for place_type, duration in _activity_durations.items()
+})
+
+
+def resolve_activity(place_types: List[str]) -> Optional[Tuple[ActivityType, int]]:
+    """Returns the (ActivityType, duration) of the first known place type, if any"""
+    for place_type in place_types:
+        activity = ACTIVITY_TABLE.get(place_type)
+        if activity is not None:
+            return activity
+    return None
+
 
 class TimeSlot(str, Enum):
     MORNING = "morning"
@@ -145,9 +211,7 @@ def get_activity_duration(activity_type: ActivityType) -> int:
     Get the duration for a specific activity type.
     Falls back to default duration if not specified.
     """
-    activity_data = load_activity_types()
-    durations = activity_data.get("durations", {})
-
-    default_duration = 90
+    # Enum members hash by name, so look the table up by value
+    activity = ACTIVITY_TABLE.get(getattr(activity_type, "value", activity_type))
+    return activity[1] if activity is not None else DEFAULT_ACTIVITY_DURATION
 
-    return durations.get(str(activity_type), default_duration)
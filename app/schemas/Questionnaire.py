@@ -52,6 +52,9 @@ class TripCreate(BaseModel):
     keywords: List[str] = []
     must_visit_places: Optional[List[PlaceInfo]] = []
     is_group: bool
+    # improve the itinerary with local search until the deadline (OPTIMIZER_DEADLINE_MS by default)
+    optimize: bool = False
+    optimize_deadline_ms: Optional[float] = None
 
 class TripResponse(BaseModel):
     itinerary: TripItinerary | RoadItinerary
@@ -60,3 +63,5 @@ class TripResponse(BaseModel):
     generic_type_scores: Dict[str, float]
     id: str
     is_group: bool
+    # search iterations completed by the optimizer, when it ran
+    optimizer_iterations: Optional[int] = None
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, Tuple, Union
+import json
+import os
+import zlib
+import msgpack
+from pydantic import BaseModel
+
+# Version written by encode_cache_value, older versions stay readable
+CACHE_CODEC_VERSION = 1
+# Payloads smaller than this are stored uncompressed
+CACHE_COMPRESSION_MIN_BYTES = int(os.getenv("CACHE_COMPRESSION_MIN_BYTES", "256"))
+# zlib level of the compressed payloads, 1 (fastest) to 9 (smallest)
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "6"))
+
+# 0xc1 is never used by msgpack and can't start a JSON document nor UTF-8 text,
+# so a leading 0xc1 tells the binary entries from the legacy JSON ones
+_MAGIC = b"\xc1"
+_FLAG_ZLIB = 0x01
+
+# Field names of the cached documents, preloaded as the zlib dictionary so even the
+# first occurrence of every name is a back-reference.
+# A version's list must never change once written, new names go in a new version.
+_FIELD_NAMES: Dict[int, Tuple[str, ...]] = {
+    1: (
+        # Google places payloads kept in PlaceInfo
+        "wheelchairAccessibleParking", "wheelchairAccessibleEntrance",
+        "wheelchairAccessibleRestroom", "wheelchairAccessibleSeating",
+        "openNow", "periods", "open", "close", "day", "hour", "minute", "date", "year", "month",
+        "weekdayDescriptions", "nextOpenTime", "nextCloseTime",
+        "name", "widthPx", "heightPx", "authorAttributions", "displayName", "uri", "photoUri",
+        "flagContentUri", "googleMapsUri", "url",
+        # trip response
+        "trip_type", "template_type", "generic_type_scores", "is_group", "optimizer_iterations",
+        "itinerary", "start_date", "end_date", "days", "price_range",
+        "stops", "index", "suggestions",
+        "routes", "polylineEncoded", "distance",
+        "morning_activities", "afternoon_activities",
+        "start_time", "end_time", "activity_type", "duration",
+        "start_price", "end_price", "currency",
+        # PlaceInfo, the most repeated names last, closest to the data
+        "photos", "accessibility_options", "opening_hours", "price_level",
+        "international_phone_number", "national_phone_number",
+        "allows_dogs", "good_for_children", "good_for_groups", "keyword_match",
+        "rating", "user_ratings_total", "types", "location", "latitude", "longitude",
+        "place", "id",
+    ),
+}
+
+_ZLIB_DICTIONARIES: Dict[int, bytes] = {
+    version: b"".join(msgpack.packb(name) for name in names)
+    for version, names in _FIELD_NAMES.items()
+}
+
+
+def _default(obj: Any) -> Any:
+    # same representations as the JSON entries, so pydantic parses both alike
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Can't encode {type(obj).__name__} for the cache")
+
+
+def encode_cache_value(value: Any) -> bytes:
+    """
+    Serializes a cache document (dicts, lists, pydantic models) to the compact format:
+    a header (magic byte, codec version, flags) followed by the msgpack encoding of the
+    value, zlib-compressed with the field-name dictionary of the version when large enough.
+    """
+    payload = msgpack.packb(value, default=_default, use_bin_type=True)
+    flags = 0
+    if len(payload) >= CACHE_COMPRESSION_MIN_BYTES:
+        compressor = zlib.compressobj(CACHE_COMPRESSION_LEVEL, zdict=_ZLIB_DICTIONARIES[CACHE_CODEC_VERSION])
+        payload = compressor.compress(payload) + compressor.flush()
+        flags |= _FLAG_ZLIB
+    return _MAGIC + bytes((CACHE_CODEC_VERSION, flags)) + payload
+
+
+def decode_cache_value(data: Union[bytes, str]) -> Any:
+    """
+    Deserializes a cache document written by encode_cache_value with any known codec
+    version, or a legacy JSON document.
+    """
+    if isinstance(data, str) or not data.startswith(_MAGIC):
+        return json.loads(data)
+    version, flags = data[1], data[2]
+    if version not in _ZLIB_DICTIONARIES:
+        raise ValueError(f"Unknown cache codec version {version}")
+    payload = data[3:]
+    if flags & _FLAG_ZLIB:
+        payload = zlib.decompressobj(zdict=_ZLIB_DICTIONARIES[version]).decompress(payload)
+    return msgpack.unpackb(payload, raw=False)
@@ -1,7 +1,9 @@
 import math
 from typing import List
+import numpy as np
 from app.schemas.Activities import LatLong, PlaceInfo
-R = 6371e3
+from app.utils.geo import EARTH_RADIUS, distance_matrix, places_to_arrays
+R = EARTH_RADIUS
 
 def calculate_distance_lat_long(location1:LatLong,location2:LatLong)->float:
 
@@ -20,19 +22,10 @@ def calculate_distance_lat_long(location1:LatLong,location2:LatLong)->float:
 
     return d 
 
-def calculate_distance_matrix(places:List[PlaceInfo],both=False):
-    distance_matrix=[[-1.0 for i in range(len(places))] for j in range(len(places))]
-    for c in range(len(places)):
-        for r in range(c,len(places)):
-            if r == c :
-                continue
-            locationR:LatLong=places[r].location
-            locationC:LatLong=places[c].location
-            distance_matrix[r][c]=calculate_distance_lat_long(locationC,locationR)
-            if both:
-                distance_matrix[c][r]=distance_matrix[r][c]
-
-    return distance_matrix
+def calculate_distance_matrix(places:List[PlaceInfo],dtype:type=np.float64)->np.ndarray:
+    # full symmetric matrix in meters, 0 on the diagonal
+    latitudes,longitudes=places_to_arrays(places)
+    return distance_matrix(latitudes,longitudes,dtype=dtype)
 def convert_lat_long(cood:LatLong):
     return [cood.longitude,cood.latitude] 
 
@@ -0,0 +1,109 @@
+from typing import List, Tuple, Union
+import numpy as np
+from app.schemas.Activities import LatLong, PlaceInfo
+
+# Earth radius in meters
+EARTH_RADIUS = 6371e3
+
+
+def locations_to_arrays(locations: List[LatLong]) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitude and longitude arrays (degrees) of a list of coordinates"""
+    n = len(locations)
+    latitudes = np.fromiter((c.latitude for c in locations), dtype=float, count=n)
+    longitudes = np.fromiter((c.longitude for c in locations), dtype=float, count=n)
+    return latitudes, longitudes
+
+
+def places_to_arrays(places: List[PlaceInfo]) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitude and longitude arrays (degrees) of the locations of a list of places"""
+    return locations_to_arrays([p.location for p in places])
+
+
+def haversine(
+    lat1: Union[float, np.ndarray],
+    lon1: Union[float, np.ndarray],
+    lat2: Union[float, np.ndarray],
+    lon2: Union[float, np.ndarray],
+    dtype: type = np.float64,
+) -> np.ndarray:
+    """
+    Great-circle distance in meters between coordinates given in degrees.
+    The arguments broadcast against each other like any numpy operation.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=dtype)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat1 - lat2) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon1 - lon2) / 2) ** 2
+    return (2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))).astype(dtype, copy=False)
+
+
+def distance_matrix(latitudes: np.ndarray, longitudes: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """Full symmetric (n, n) matrix of the distances in meters between n coordinates"""
+    return haversine(latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :], dtype=dtype)
+
+
+def distances_to(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    latitude: float,
+    longitude: float,
+    dtype: type = np.float64,
+) -> np.ndarray:
+    """Distances in meters from many coordinates to a single point"""
+    return haversine(latitudes, longitudes, latitude, longitude, dtype=dtype)
+
+
+def consecutive_distances(latitudes: np.ndarray, longitudes: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """Distances in meters between each coordinate and the next one, n-1 values"""
+    return haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:], dtype=dtype)
+
+
+def within_radius(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    latitude: float,
+    longitude: float,
+    radius: float,
+) -> np.ndarray:
+    """Mask of the coordinates at most radius meters away from a point"""
+    return distances_to(latitudes, longitudes, latitude, longitude) <= radius
+
+
+def padded_rings(rings: List[List[LatLong]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Packs several polygons (rings of coordinates) into (n_rings, max_len) latitude and
+    longitude tensors. Shorter rings are padded with their first vertex, which adds
+    no area, and empty rings are all 0.
+
+    Returns:
+        The latitude tensor, the longitude tensor and the number of vertices of each ring
+    """
+    counts = np.fromiter((len(ring) for ring in rings), dtype=np.int64, count=len(rings))
+    width = max(int(counts.max()) if len(rings) else 0, 1)
+    flat_latitudes, flat_longitudes = locations_to_arrays([c for ring in rings for c in ring])
+    if len(flat_latitudes) == 0:
+        return np.zeros((len(rings), width)), np.zeros((len(rings), width)), counts
+
+    starts = np.cumsum(counts) - counts
+    columns = np.arange(width)[None, :]
+    index = starts[:, None] + np.where(columns < counts[:, None], columns, 0)
+    # empty rings point past the end, they are zeroed below
+    index = np.minimum(index, len(flat_latitudes) - 1)
+    latitudes, longitudes = flat_latitudes[index], flat_longitudes[index]
+    latitudes[counts == 0] = 0.0
+    longitudes[counts == 0] = 0.0
+    return latitudes, longitudes, counts
+
+
+def spherical_polygon_areas(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Areas in square meters of the polygons of (n_rings, max_len) coordinate tensors,
+    following the vertices in order (closed from the last vertex back to the first).
+    Uses the spherical excess approximation of the ring area, summing every edge
+    of every ring at once. Rings with fewer than 3 distinct vertices have no area.
+    """
+    phi = np.radians(latitudes)
+    lam = np.radians(longitudes)
+    phi_next = np.roll(phi, -1, axis=-1)
+    # longitude steps wrapped to [-pi, pi), so rings crossing the antimeridian stay small
+    dlam = (np.roll(lam, -1, axis=-1) - lam + np.pi) % (2 * np.pi) - np.pi
+    edges = dlam * (2 + np.sin(phi) + np.sin(phi_next))
+    return np.abs(edges.sum(axis=-1)) * EARTH_RADIUS ** 2 / 2
@@ -0,0 +1,67 @@
+import httpx
+import os
+from typing import Dict, Optional, Any
+import logging
+
+logger = logging.getLogger("uvicorn.error")
+
+# Base urls of the services this one depends on
+UPSTREAMS: Dict[str, str] = {
+    "place-wrapper": os.getenv("PLACE_WRAPPER_URL", "http://place-wrapper:8080"),
+    "maps-wrapper": os.getenv("MAPS_WRAPPER_URL", "http://maps-wrapper:8080"),
+    "user-management": os.getenv("USER_MANAGEMENT_URL", "http://user-management:8080"),
+}
+
+
+def _env_setting(upstream: str, name: str, default: float) -> float:
+    """Reads a per-upstream setting (e.g. PLACE_WRAPPER_TIMEOUT), falling back to the global one (HTTP_TIMEOUT)"""
+    prefix = upstream.upper().replace("-", "_")
+    value = os.getenv(f"{prefix}_{name}", os.getenv(f"HTTP_{name}"))
+    return float(value) if value is not None else default
+
+
+class HTTPClientPool:
+    """
+    Keeps one keep-alive httpx.AsyncClient per upstream service,
+    so requests reuse pooled connections instead of opening a new one each time.
+    """
+    def __init__(self, upstreams: Dict[str, str]):
+        self.upstreams = upstreams
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create_client(self, upstream: str) -> httpx.AsyncClient:
+        timeout = httpx.Timeout(
+            _env_setting(upstream, "TIMEOUT", 30.0),
+            connect=_env_setting(upstream, "CONNECT_TIMEOUT", 5.0),
+        )
+        limits = httpx.Limits(
+            max_connections=int(_env_setting(upstream, "MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(_env_setting(upstream, "MAX_KEEPALIVE_CONNECTIONS", 20)),
+        )
+        logger.info(f"Creating HTTP client for {upstream} with {timeout} and {limits}")
+        return httpx.AsyncClient(base_url=self.upstreams[upstream], timeout=timeout, limits=limits)
+
+    def client(self, upstream: str) -> httpx.AsyncClient:
+        # Created lazily as well, so handlers also work outside of the app lifespan
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = self._create_client(upstream)
+            self._clients[upstream] = client
+        return client
+
+    async def get(self, upstream: str, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.client(upstream).get(path, **kwargs)
+
+    async def post(self, upstream: str, path: str, json: Optional[Any] = None, **kwargs: Any) -> httpx.Response:
+        return await self.client(upstream).post(path, json=json, **kwargs)
+
+    async def startup(self) -> None:
+        for upstream in self.upstreams:
+            self.client(upstream)
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+http_clients = HTTPClientPool(UPSTREAMS)
@@ -1,19 +1,145 @@
 import openai
 import os
-from typing import List, Dict
+import asyncio
+import hashlib
+import logging
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 import json
+import redis
 from datetime import datetime, timedelta
 from app.schemas.Activities import Activity, TripItinerary, DayItinerary
+from app.utils.redis_utils import redis_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+# Maximum number of days scheduled by the LLM at the same time for one trip
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "5"))
+# Seconds a parsed day schedule stays cached
+SCHEDULE_CACHE_TTL = int(os.getenv("SCHEDULE_CACHE_TTL", "604800"))  # 7 days
+
+DAY_SCHEDULE_FORMAT = {
+    "format": {
+        "type": "json_schema",
+        "name": "itinerary",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "activities": {
+                    "type": "array",
+                    "description": "A list of planned activities for the day.",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {
+                                "type": "string",
+                                "description": "The name of the activity."
+                            },
+                            "duration": {
+                                "type": "string",
+                                "description": "Expected duration of the activity."
+                            },
+                            "start_time": {
+                                "type": "string",
+                                "description": "The start time for the activity in HH:MM format."
+                            },
+                            "end_time": {
+                                "type": "string",
+                                "description": "The end time for the activity in HH:MM format."
+                            }
+                        },
+                        "required": [
+                            "name",
+                            "duration",
+                            "start_time",
+                            "end_time"
+                        ],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": [
+                "activities"
+            ],
+            "additionalProperties": False
+        }
+    }
+}
+
+_async_clients: Dict[str, openai.AsyncOpenAI] = {}
+
+
+def get_async_client(api_key: str) -> openai.AsyncOpenAI:
+    """Shares one async client (and its connection pool) per api key"""
+    if api_key not in _async_clients:
+        _async_clients[api_key] = openai.AsyncOpenAI(api_key=api_key)
+    return _async_clients[api_key]
+
+
+def schedule_cache_key(day: DayItinerary, activities: List[Activity]) -> str:
+    """Days with the same weekday and the same ordered activities share the schedule"""
+    names = [activity.place.name for activity in activities]
+    digest = hashlib.sha256(json.dumps([day.date.weekday(), names]).encode()).hexdigest()
+    return f"schedule:{digest}"
+
+
+def parse_scheduled_activities(response) -> List[Dict]:
+    """Extracts the scheduled activities from the structured output of the LLM"""
+    # The JSON is in response.output[1].content[0].text
+    if hasattr(response, 'output') and isinstance(response.output, list):
+        # Find the message output (usually at index 1 after web search)
+        for output_item in response.output:
+            if hasattr(output_item, 'content') and isinstance(output_item.content, list):
+                for content_item in output_item.content:
+                    if hasattr(content_item, 'text') and isinstance(content_item.text, str):
+                        # Found the text content, which contains the JSON
+                        text_content = content_item.text.strip()
+                        try:
+                            # Parse the JSON string
+                            data = json.loads(text_content)
+                            if isinstance(data, dict) and 'activities' in data:
+                                return data['activities']
+                        except json.JSONDecodeError as e:
+                            print(f"Error parsing JSON: {e}")
+                            print(f"Text content: {text_content[:100]}...")
+    return []
+
 
 class OpenAIAPI:
     def __init__(self, api_key: str):
         self.api_key = api_key
         openai.api_key = self.api_key
 
-    def generate_itinerary(self, itinerary: TripItinerary) -> TripItinerary:
+    async def schedule_day(self, day: DayItinerary, activities: List[Activity]) -> List[Dict]:
+        """Asks the LLM for the schedule of a single day"""
+        # Format activities as JSON-serializable data
+        activities_data = [{"name": activity.place.name} for activity in activities]
+
+        # Create a properly formatted message with user role
+        message = {
+            "role": "user",
+            "content": f"Create a daily schedule for {day.date.strftime('%Y-%m-%d')} based on these activities: {json.dumps(activities_data)}"
+        }
+
+        response = await get_async_client(self.api_key).responses.create(
+            model="gpt-4o-mini-2024-07-18",
+            input=[message],
+            text=DAY_SCHEDULE_FORMAT,
+            reasoning={},
+
+            temperature=1,
+            max_output_tokens=2048,
+            top_p=1,
+            store=True
+        )
+        return parse_scheduled_activities(response)
+
+    async def generate_itinerary(self, itinerary: TripItinerary) -> TripItinerary:
         """
         Generate a schedule for each day in the itinerary and return the updated itinerary.
+        Days are scheduled concurrently (at most OPENAI_CONCURRENCY at a time) and
+        schedules are cached, so days already seen skip the LLM.
         
         Args:
             itinerary: The trip itinerary containing days and activities
@@ -21,171 +147,104 @@ class OpenAIAPI:
         Returns:
             An updated itinerary with proposed scheduling for each day
         """
-        # Custom function to handle datetime serialization
-        def serialize_activity(activity):
-            return {"name": activity.place.name}
-        
-        # Process each day in the itinerary
-        for i, day in enumerate(itinerary.days):
-            # Combine morning and afternoon activities for processing
-            all_activities = day.morning_activities + day.afternoon_activities
+        # Combine morning and afternoon activities for processing, skip days with no activities
+        days_activities = [
+            (i, day, day.morning_activities + day.afternoon_activities)
+            for i, day in enumerate(itinerary.days)
+            if day.morning_activities or day.afternoon_activities
+        ]
+        if not days_activities:
+            return itinerary
+
+        cache_keys = [schedule_cache_key(day, activities) for _, day, activities in days_activities]
+        try:
+            cached_schedules = await redis_cache.get_many(cache_keys)
+        except redis.RedisError as e:
+            logger.warning(f"Could not read day schedules from cache: {str(e)}")
+            cached_schedules = [None] * len(cache_keys)
+
+        semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY)
+
+        async def schedule(day: DayItinerary, activities: List[Activity], cached: Optional[bytes]) -> List[Dict]:
+            if cached is not None:
+                return json.loads(cached)
+            async with semaphore:
+                return await self.schedule_day(day, activities)
+
+        schedules = await asyncio.gather(*(
+            schedule(day, activities, cached)
+            for (_, day, activities), cached in zip(days_activities, cached_schedules)
+        ))
+
+        new_schedules = {
+            key: json.dumps(scheduled)
+            for key, scheduled, cached in zip(cache_keys, schedules, cached_schedules)
+            if scheduled and cached is None
+        }
+        try:
+            await redis_cache.set_many(new_schedules, ttl=SCHEDULE_CACHE_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"Could not write day schedules to cache: {str(e)}")
+
+        for (i, day, all_activities), scheduled_activities in zip(days_activities, schedules):
+            # If we still have nothing, skip processing for this day
+            if not scheduled_activities:
+                print(f"Could not extract activities from the response")
+                continue
+            self.apply_schedule(itinerary, i, day, all_activities, scheduled_activities)
+
+        return itinerary
+
+    def apply_schedule(
+        self,
+        itinerary: TripItinerary,
+        i: int,
+        day: DayItinerary,
+        all_activities: List[Activity],
+        scheduled_activities: List[Dict],
+    ) -> None:
+        """Updates the activity times of a day with its parsed schedule"""
+        try:
+            # Map scheduled activities back to the original activities
+            for scheduled in scheduled_activities:
+                # Find matching activity by name
+                for activity in all_activities:
+                    if activity.place.name.lower() in scheduled["name"].lower() or scheduled["name"].lower() in activity.place.name.lower():
+                        # Parse start and end times
+                        start_time_str = scheduled["start_time"]
+                        end_time_str = scheduled["end_time"]
+                        
+                        # Update the activity with the scheduled times
+                        activity_date = day.date.date()
+                        start_hour, start_minute = map(int, start_time_str.split(":"))
+                        end_hour, end_minute = map(int, end_time_str.split(":"))
+                        
+                        activity.start_time = datetime.combine(activity_date, datetime.min.time().replace(hour=start_hour, minute=start_minute))
+                        activity.end_time = datetime.combine(activity_date, datetime.min.time().replace(hour=end_hour, minute=end_minute))
+                        break
             
-            if not all_activities:
-                continue  # Skip days with no activities
+            # Re-sort morning and afternoon activities based on start time
+            morning_activities = []
+            afternoon_activities = []
             
-            # Format activities as JSON-serializable data
-            activities_data = []
             for activity in all_activities:
-                activity_dict = serialize_activity(activity)
-                activities_data.append(activity_dict)
-
+                if activity.start_time.hour < 12:
+                    morning_activities.append(activity)
+                else:
+                    afternoon_activities.append(activity)
             
-            # Create a properly formatted message with user role
-            message = {
-                "role": "user",
-                "content": f"Create a daily schedule for {day.date.strftime('%Y-%m-%d')} based on these activities: {json.dumps(activities_data)}"
-            }
-
+            # Sort by start time
+            morning_activities.sort(key=lambda x: x.start_time)
+            afternoon_activities.sort(key=lambda x: x.start_time)
             
+            # Update the day's activities
+            itinerary.days[i].morning_activities = morning_activities
+            itinerary.days[i].afternoon_activities = afternoon_activities
 
-            response = openai.responses.create(
-                model="gpt-4o-mini-2024-07-18",
-                input=[message],
-                text={
-                    "format": {
-                        "type": "json_schema",
-                        "name": "itinerary",
-                        "strict": True,
-                        "schema": {
-                            "type": "object",
-                            "properties": {
-                                "activities": {
-                                    "type": "array",
-                                    "description": "A list of planned activities for the day.",
-                                    "items": {
-                                        "type": "object",
-                                        "properties": {
-                                            "name": {
-                                                "type": "string",
-                                                "description": "The name of the activity."
-                                            },
-                                            "duration": {
-                                                "type": "string",
-                                                "description": "Expected duration of the activity."
-                                            },
-                                            "start_time": {
-                                                "type": "string",
-                                                "description": "The start time for the activity in HH:MM format."
-                                            },
-                                            "end_time": {
-                                                "type": "string",
-                                                "description": "The end time for the activity in HH:MM format."
-                                            }
-                                        },
-                                        "required": [
-                                            "name",
-                                            "duration",
-                                            "start_time",
-                                            "end_time"
-                                        ],
-                                        "additionalProperties": False
-                                    }
-                                }
-                            },
-                            "required": [
-                                "activities"
-                            ],
-                            "additionalProperties": False
-                        }
-                    }
-                },
-                reasoning={},
-
-                temperature=1,
-                max_output_tokens=2048,
-                top_p=1,
-                store=True
-            )
-
+            print(f"Updated itinerary: {itinerary}")
             
-            # Parse the response and update the activity times in the itinerary
-            try:
-                # Debug the response object type
-                
-                # Based on the actual OpenAI API response structure, extract the JSON
-                scheduled_activities = []
-                
-                # The JSON is in response.output[1].content[0].text
-                if hasattr(response, 'output') and isinstance(response.output, list):
-                    # Find the message output (usually at index 1 after web search)
-                    for output_item in response.output:
-                        if hasattr(output_item, 'content') and isinstance(output_item.content, list):
-                            for content_item in output_item.content:
-                                if hasattr(content_item, 'text') and isinstance(content_item.text, str):
-                                    # Found the text content, which contains the JSON
-                                    text_content = content_item.text.strip()
-                                    try:
-                                        # Parse the JSON string
-                                        data = json.loads(text_content)
-                                        if isinstance(data, dict) and 'activities' in data:
-                                            scheduled_activities = data['activities']
-                                            break
-                                    except json.JSONDecodeError as e:
-                                        print(f"Error parsing JSON: {e}")
-                                        print(f"Text content: {text_content[:100]}...")
-                            
-                            # If we found activities, break from the outer loop
-                            if scheduled_activities:
-                                break
-                
-                # If we still have nothing, print the full response
-                if not scheduled_activities:
-                    print(f"Could not extract activities from the response")
-                    # Skip processing for this day
-                    continue
-                
-                # Map scheduled activities back to the original activities
-                for scheduled in scheduled_activities:
-                    # Find matching activity by name
-                    for activity in all_activities:
-                        if activity.place.name.lower() in scheduled["name"].lower() or scheduled["name"].lower() in activity.place.name.lower():
-                            # Parse start and end times
-                            start_time_str = scheduled["start_time"]
-                            end_time_str = scheduled["end_time"]
-                            
-                            # Update the activity with the scheduled times
-                            activity_date = day.date.date()
-                            start_hour, start_minute = map(int, start_time_str.split(":"))
-                            end_hour, end_minute = map(int, end_time_str.split(":"))
-                            
-                            activity.start_time = datetime.combine(activity_date, datetime.min.time().replace(hour=start_hour, minute=start_minute))
-                            activity.end_time = datetime.combine(activity_date, datetime.min.time().replace(hour=end_hour, minute=end_minute))
-                            break
-                
-                # Re-sort morning and afternoon activities based on start time
-                morning_activities = []
-                afternoon_activities = []
-                
-                for activity in all_activities:
-                    if activity.start_time.hour < 12:
-                        morning_activities.append(activity)
-                    else:
-                        afternoon_activities.append(activity)
-                
-                # Sort by start time
-                morning_activities.sort(key=lambda x: x.start_time)
-                afternoon_activities.sort(key=lambda x: x.start_time)
-                
-                # Update the day's activities
-                itinerary.days[i].morning_activities = morning_activities
-                itinerary.days[i].afternoon_activities = afternoon_activities
-
-                print(f"Updated itinerary: {itinerary}")
-                
-            except Exception as e:
-                print(f"Error processing day {day.date}: {str(e)}")
-        
-        return itinerary
+        except Exception as e:
+            print(f"Error processing day {day.date}: {str(e)}")
 
 
     def generate_radius(self, place_name: str) -> int:
@@ -0,0 +1,128 @@
+from typing import Dict, List, Optional, Union
+import logging
+import os
+from app.schemas.Activities import PlaceInfo
+from app.utils.cache_codec import decode_cache_value, encode_cache_value
+from app.utils.redis_utils import RedisCache, redis_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+# Seconds a place document stays cached, refreshed by every trip that writes it.
+# Kept as long as the trips referencing it by default
+PLACE_CACHE_TTL = int(os.getenv("PLACE_CACHE_TTL", "604800"))  # 7 days
+
+# Fields that depend on the trip that found the place (e.g. matched its keywords),
+# kept in the trip and never in the shared documents
+TRIP_PLACE_FIELDS = ("keyword_match",)
+
+# Ranked places of each category as stored in a trip: place ids, a reference
+# {"id": ..., <trip fields>} for the places with trip specific values, or the whole
+# place document for the places without an id (and the legacy entries)
+PlaceRankings = Dict[str, List[Union[str, dict]]]
+
+
+def trip_place_fields(place: PlaceInfo) -> dict:
+    """Trip specific values of a place that differ from the defaults"""
+    return {
+        field: getattr(place, field)
+        for field in TRIP_PLACE_FIELDS
+        if getattr(place, field) != PlaceInfo.model_fields[field].default
+    }
+
+
+def place_document(place: PlaceInfo) -> bytes:
+    """Shared document of a place, without the trip specific fields"""
+    return encode_cache_value(place.dict(exclude=set(TRIP_PLACE_FIELDS)))
+
+
+class PlaceStore:
+    """
+    Place documents shared by every trip, one "place:{id}" key per place.
+    Trips only keep the ordered place ids of each category and hydrate them
+    back with a single MGET, so the cache grows with the distinct places
+    instead of the trips times their places.
+    """
+    def __init__(self, cache: RedisCache, ttl: int):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def key(place_id: str) -> str:
+        return f"place:{place_id}"
+
+    async def save(self, places_by_category: Dict[str, List[PlaceInfo]]) -> PlaceRankings:
+        """
+        Writes the documents of the places and returns the rankings referencing them.
+
+        Args:
+            places_by_category: Ranked places of each category
+
+        Returns:
+            The ids (or references) of the ranked places of each category
+        """
+        documents: Dict[str, bytes] = {}
+        rankings: PlaceRankings = {}
+        for category, places in places_by_category.items():
+            ranking = []
+            for place in places:
+                if place.id is None:
+                    ranking.append(place.dict())
+                    continue
+                key = self.key(place.id)
+                if key not in documents:
+                    documents[key] = place_document(place)
+                trip_fields = trip_place_fields(place)
+                ranking.append({"id": place.id, **trip_fields} if trip_fields else place.id)
+            rankings[category] = ranking
+        await self.cache.set_many(documents, ttl=self.ttl)
+        return rankings
+
+    async def load(self, rankings: PlaceRankings) -> Dict[str, List[PlaceInfo]]:
+        """
+        Hydrates the rankings of a trip with the shared place documents.
+        Places whose document expired are left out of their ranking.
+
+        Args:
+            rankings: Ids (or documents) of the ranked places of each category
+
+        Returns:
+            The ranked places of each category
+        """
+        place_ids = list(dict.fromkeys(
+            ref_id for ranking in rankings.values() for item in ranking
+            if (ref_id := self._reference_id(item)) is not None
+        ))
+        values = await self.cache.get_many([self.key(place_id) for place_id in place_ids])
+        places: Dict[str, PlaceInfo] = {
+            place_id: PlaceInfo(**decode_cache_value(value))
+            for place_id, value in zip(place_ids, values)
+            if value is not None
+        }
+        if len(places) < len(place_ids):
+            logger.warning(f"{len(place_ids) - len(places)} of {len(place_ids)} place documents expired")
+
+        hydrated: Dict[str, List[PlaceInfo]] = {}
+        for category, ranking in rankings.items():
+            hydrated[category] = []
+            for item in ranking:
+                ref_id = self._reference_id(item)
+                if ref_id is None:
+                    hydrated[category].append(PlaceInfo(**item))
+                elif ref_id in places:
+                    place = places[ref_id]
+                    if isinstance(item, dict):
+                        # trip specific values on top of the shared document
+                        place = place.model_copy(update={k: v for k, v in item.items() if k != "id"})
+                    hydrated[category].append(place)
+        return hydrated
+
+    @staticmethod
+    def _reference_id(item: Union[str, dict]) -> Optional[str]:
+        """Place id of a ranking item, None for the whole place documents"""
+        if isinstance(item, str):
+            return item
+        if "name" not in item:
+            return item["id"]
+        return None
+
+place_store = PlaceStore(redis_cache, PLACE_CACHE_TTL)
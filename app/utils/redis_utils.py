@@ -1,36 +1,79 @@
-import redis
+import redis.asyncio as redis
+import inspect
 import json
-from typing import Optional, TypeVar, Callable, Any
+import os
+from typing import Awaitable, Dict, List, Optional, TypeVar, Callable, Union
 import logging
 
 logger = logging.getLogger("uvicorn.error")
 
 T = TypeVar('T')
 
+REDIS_HOST = os.getenv("REDIS_HOST", "recommendations_cache")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+# Connections shared by every request of the worker
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+
 class RedisCache:
-    def __init__(self, host: str = "recommendations_cache", port: int = 6379, db: int = 0):
-        self.redis_client = redis.Redis(host=host, port=port, db=db)
+    """
+    Asyncio Redis client over a shared connection pool.
+    Multi-key reads and writes go through MGET and pipelines, one round-trip per call.
+    """
+    def __init__(
+        self,
+        host: str = REDIS_HOST,
+        port: int = REDIS_PORT,
+        db: int = REDIS_DB,
+        max_connections: int = REDIS_MAX_CONNECTIONS,
+    ):
+        self.pool = redis.ConnectionPool(host=host, port=port, db=db, max_connections=max_connections)
+        self.redis_client = redis.Redis(connection_pool=self.pool)
 
-    def get(self, key: str) -> Optional[str]:
-        value = self.redis_client.get(key)
+    async def get(self, key: str) -> Optional[bytes]:
+        value = await self.redis_client.get(key)
         if value is not None:
-            logger.info(f"Cache hit for key: {key}")
+            logger.debug(f"Cache hit for key: {key}")
         else:
-            logger.info(f"Cache miss for key: {key}")
+            logger.debug(f"Cache miss for key: {key}")
         return value
 
-    def set(self, key: str, value: str, ttl: int = 3600) -> bool:
-        logger.info(f"Setting cache for key: {key} with TTL: {ttl}s")
-        return self.redis_client.setex(key, ttl, value)
+    async def set(self, key: str, value: Union[str, bytes], ttl: int = 3600) -> bool:
+        logger.debug(f"Setting cache for key: {key} with TTL: {ttl}s")
+        return await self.redis_client.setex(key, ttl, value)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        values = await self.redis_client.mget(keys)
+        hits = sum(value is not None for value in values)
+        logger.debug(f"Cache hits for {hits} of {len(keys)} keys")
+        return values
 
-    def get_or_set(self, key: str, value_func: Callable[[], T], ttl: int = 3600) -> T:
-        cached_value = self.get(key)
+    async def set_many(self, values: Dict[str, Union[str, bytes]], ttl: int = 3600) -> None:
+        if not values:
+            return
+        logger.debug(f"Setting cache for {len(values)} keys with TTL: {ttl}s")
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            for key, value in values.items():
+                pipeline.setex(key, ttl, value)
+            await pipeline.execute()
+
+    async def get_or_set(self, key: str, value_func: Callable[[], Union[T, Awaitable[T]]], ttl: int = 3600) -> T:
+        cached_value = await self.get(key)
         if cached_value is not None:
             return json.loads(cached_value)
-        
-        logger.info(f"Cache miss, computing new value for key: {key}")
+
+        logger.debug(f"Cache miss, computing new value for key: {key}")
         value = value_func()
-        self.set(key, json.dumps(value), ttl)
+        if inspect.isawaitable(value):
+            value = await value
+        await self.set(key, json.dumps(value), ttl)
         return value
 
-redis_cache = RedisCache() 
\ No newline at end of file
+    async def close(self) -> None:
+        await self.redis_client.aclose()
+        await self.pool.disconnect()
+
+redis_cache = RedisCache()
@@ -0,0 +1,79 @@
+from typing import Dict, List, Tuple
+import numpy as np
+from app.attributes.budget_dic import average_prices
+from app.attributes.continents_bounds import continent_bounds, continent_overrides
+from app.schemas.Activities import PlaceInfo
+
+GRID_RESOLUTION = 0.25  # degrees per cell
+UNKNOWN_REGION = "Unknown"
+# Currency of places outside every priced continent
+DEFAULT_CURRENCY = "EUR"
+
+
+class RegionIndex:
+    """
+    Precomputed lat/lon grid mapping every cell to a region (continent) id,
+    with the currency and the average price of every category of each region.
+    The continent boxes are painted so that the first matching continent of
+    continent_bounds wins, then the overrides refine the ambiguous borders.
+    """
+    def __init__(
+        self,
+        bounds: Dict[str, Dict[str, Tuple[float, float]]],
+        overrides: List[Tuple[str, Dict[str, Tuple[float, float]]]],
+        prices: Dict[str, Dict[str, Dict]],
+        resolution: float = GRID_RESOLUTION,
+    ):
+        self.resolution = resolution
+        self.regions: List[str] = list(bounds) + [UNKNOWN_REGION]
+        self.region_ids: Dict[str, int] = {region: i for i, region in enumerate(self.regions)}
+        self.unknown_id = self.region_ids[UNKNOWN_REGION]
+
+        self.grid = np.full((round(180 / resolution), round(360 / resolution)), self.unknown_id, dtype=np.int8)
+        for region in reversed(list(bounds)):
+            self._paint(self.region_ids[region], bounds[region])
+        for region, region_bounds in overrides:
+            self._paint(self.region_ids[region], region_bounds)
+
+        self.categories: List[str] = list(prices)
+        self.category_ids: Dict[str, int] = {category: i for i, category in enumerate(self.categories)}
+        self.currencies = np.array([
+            prices["cultural"].get(region, {}).get("currency", DEFAULT_CURRENCY) for region in self.regions
+        ], dtype=object)
+        # regions x categories, 0 where a region has no average price
+        self.average_prices = np.array([
+            [prices[category].get(region, {}).get("price", 0.0) for category in self.categories]
+            for region in self.regions
+        ], dtype=float)
+        self.has_prices = np.array([
+            all(region in prices[category] for category in self.categories) for region in self.regions
+        ])
+
+    def _cells(self, latitudes: np.ndarray, longitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.floor((np.asarray(latitudes, dtype=float) + 90) / self.resolution).astype(np.int64)
+        cols = np.floor((np.asarray(longitudes, dtype=float) + 180) / self.resolution).astype(np.int64)
+        return np.clip(rows, 0, self.grid.shape[0] - 1), np.clip(cols, 0, self.grid.shape[1] - 1)
+
+    def _paint(self, region_id: int, bounds: Dict[str, Tuple[float, float]]) -> None:
+        lat_min, lat_max = bounds["lat"]
+        lon_min, lon_max = bounds["lon"]
+        row_start = int(np.floor((lat_min + 90) / self.resolution))
+        row_end = int(np.ceil((lat_max + 90) / self.resolution))
+        col_start = int(np.floor((lon_min + 180) / self.resolution))
+        col_end = int(np.ceil((lon_max + 180) / self.resolution))
+        self.grid[row_start:row_end, col_start:col_end] = region_id
+
+    def lookup(self, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        """Region ids of many coordinates at once"""
+        rows, cols = self._cells(latitudes, longitudes)
+        return self.grid[rows, cols]
+
+    def lookup_places(self, places: List[PlaceInfo]) -> np.ndarray:
+        latitudes = np.fromiter((p.location.latitude for p in places), dtype=float, count=len(places))
+        longitudes = np.fromiter((p.location.longitude for p in places), dtype=float, count=len(places))
+        return self.lookup(latitudes, longitudes)
+
+    def region_name(self, latitude: float, longitude: float) -> str:
+        return self.regions[int(self.lookup(np.array([latitude]), np.array([longitude]))[0])]
+
+region_index = RegionIndex(continent_bounds, continent_overrides, average_prices)
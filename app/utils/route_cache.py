@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import time
+import redis
+from app.utils.redis_utils import RedisCache, redis_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", "86400"))  # 1 day
+ROUTE_CACHE_LOCAL_TTL = int(os.getenv("ROUTE_CACHE_LOCAL_TTL", "3600"))
+ROUTE_CACHE_LOCAL_SIZE = int(os.getenv("ROUTE_CACHE_LOCAL_SIZE", "10000"))
+
+
+class RouteLegCache:
+    """
+    Caches the maps-wrapper routes of a single leg (origin -> destination with a travel mode).
+    A bounded in-process LRU sits in front of Redis, which shares the legs between workers.
+    """
+    def __init__(self, cache: RedisCache, ttl: int, local_ttl: int, local_size: int):
+        self.cache = cache
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self._local: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+
+    @staticmethod
+    def key(origin: str, destination: str, travel_mode: str) -> str:
+        return f"route:{travel_mode}:{origin}:{destination}"
+
+    def _get_local(self, key: str) -> Optional[List[dict]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, routes = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return routes
+
+    def _set_local(self, key: str, routes: List[dict]) -> None:
+        self._local[key] = (time.monotonic() + self.local_ttl, routes)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[dict]]:
+        """Returns the cached routes of the given legs, missing legs are left out"""
+        found: Dict[str, List[dict]] = {}
+        remote_keys = []
+        for key in keys:
+            routes = self._get_local(key)
+            if routes is not None:
+                found[key] = routes
+            else:
+                remote_keys.append(key)
+
+        if remote_keys:
+            try:
+                values = await self.cache.get_many(remote_keys)
+            except redis.RedisError as e:
+                logger.warning(f"Could not read route legs from cache: {str(e)}")
+                values = [None] * len(remote_keys)
+            for key, value in zip(remote_keys, values):
+                if value is not None:
+                    routes = json.loads(value)
+                    self._set_local(key, routes)
+                    found[key] = routes
+        return found
+
+    async def set_many(self, legs: Dict[str, List[dict]]) -> None:
+        for key, routes in legs.items():
+            self._set_local(key, routes)
+        try:
+            await self.cache.set_many({key: json.dumps(routes) for key, routes in legs.items()}, ttl=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Could not write route legs to cache: {str(e)}")
+
+route_leg_cache = RouteLegCache(redis_cache, ROUTE_CACHE_TTL, ROUTE_CACHE_LOCAL_TTL, ROUTE_CACHE_LOCAL_SIZE)
@@ -0,0 +1,454 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import redis
+from app.schemas.Activities import DayItinerary, PlaceInfo, TemplateType
+from app.schemas.Questionnaire import TripResponse
+from app.utils.cache_codec import decode_cache_value, encode_cache_value
+from app.utils.place_store import PlaceRankings, PlaceStore, place_document, place_store, trip_place_fields
+from app.utils.redis_utils import RedisCache, redis_cache
+
+logger = logging.getLogger("uvicorn.error")
+
+# Seconds a trip stays cached after its last write
+TRIP_CACHE_TTL = int(os.getenv("TRIP_CACHE_TTL", "604800"))  # 7 days
+# Attempts of an edit whose day was changed by a concurrent edit
+TRIP_EDIT_RETRIES = int(os.getenv("TRIP_EDIT_RETRIES", "5"))
+# Base of the exponential backoff between the attempts of an edit, in milliseconds
+TRIP_EDIT_BACKOFF_MS = int(os.getenv("TRIP_EDIT_BACKOFF_MS", "20"))
+
+TIME_SLOTS = ("morning", "afternoon")
+
+# Pops the first place of the queues (KEYS[3:], in order) that isn't in the used
+# places set (KEYS[1]) and adds it to the set. Used places popped on the way are
+# dropped, they are pushed back when they leave the itinerary.
+# Returns the index of the queue, the place id and its trip fields from the layout
+# (KEYS[2], false when it has none), or nil when every queue is exhausted.
+CLAIM_PLACE_SCRIPT = """
+for q = 3, #KEYS do
+    while true do
+        local place_id = redis.call('LPOP', KEYS[q])
+        if not place_id then break end
+        if redis.call('SADD', KEYS[1], place_id) == 1 then
+            return {q - 3, place_id, redis.call('HGET', KEYS[2], 'trip_fields:' .. place_id)}
+        end
+    end
+end
+return nil
+"""
+
+# Writes an edited day to the layout (KEYS[1]) if its version is still the one it was
+# read with, then bumps the version. Updates the used places set (KEYS[2]) and pushes
+# the place that left the itinerary back to the end of its queue (one of KEYS[3:]).
+# Every key of the trip gets its ttl back, the place queues (KEYS[3:]) included. The
+# shared place documents are left to their own ttl, claim_place drops the expired ones.
+# ARGV: day index, expected version, ttl, day document, removed place id, trip fields of
+# the removed place, index in KEYS of its queue (0 to drop it), added place id,
+# number of locators to set, the locators as field/value pairs, the locator fields to delete.
+# Returns 1 when written, 0 on a version conflict.
+COMMIT_DAY_SCRIPT = """
+local version_field = 'version:' .. ARGV[1]
+local version = tonumber(redis.call('HGET', KEYS[1], version_field) or '0')
+if version ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'day:' .. ARGV[1], ARGV[4])
+redis.call('HINCRBY', KEYS[1], version_field, 1)
+local locators = tonumber(ARGV[9])
+for i = 0, locators - 1 do
+    redis.call('HSET', KEYS[1], ARGV[10 + 2 * i], ARGV[11 + 2 * i])
+end
+for i = 10 + 2 * locators, #ARGV do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+if ARGV[5] ~= '' then
+    redis.call('SREM', KEYS[2], ARGV[5])
+    local requeue = tonumber(ARGV[7])
+    if requeue > 0 then
+        redis.call('RPUSH', KEYS[requeue], ARGV[5])
+        if ARGV[6] ~= '' then
+            redis.call('HSET', KEYS[1], 'trip_fields:' .. ARGV[5], ARGV[6])
+        end
+    end
+end
+if ARGV[8] ~= '' then
+    redis.call('SADD', KEYS[2], ARGV[8])
+end
+for q = 3, #KEYS do
+    redis.call('EXPIRE', KEYS[q], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+
+async def edit_backoff(attempt: int) -> None:
+    """
+    Waits before the given retry of an edit, a random time up to the exponential
+    backoff (full jitter) so concurrent edits of the same day don't collide again.
+    """
+    await asyncio.sleep(random.uniform(0, TRIP_EDIT_BACKOFF_MS * 2 ** (attempt - 1)) / 1000)
+
+
+class DayEdit:
+    """A day of a cached trip loaded for an edit, with the version it was read at"""
+    def __init__(
+        self,
+        trip_id: str,
+        day_index: Optional[int],
+        day: Optional[DayItinerary],
+        day_count: int,
+        version: int = 0,
+        categories: Optional[List[str]] = None,
+    ):
+        self.trip_id = trip_id
+        self.day_index = day_index
+        self.day = day
+        self.day_count = day_count
+        self.version = version
+        self.categories = categories
+
+
+class TripStore:
+    """
+    Cached place trips, laid out so an edit only reads and writes the day it touches.
+
+    trip:{id}:layout is a hash with the trip fields ("meta"), the itinerary fields
+    without the days ("itinerary"), one "day:{n}" field per day with its "version:{n}",
+    one "activity:{id}" -> "day:slot:index" locator per activity, the categories
+    of the place queues ("queues") and the trip specific fields of the queued places
+    ("trip_fields:{place id}"), which the shared place documents leave out.
+    trip:{id}:used_places is the set of the place ids in the itinerary and
+    trip:{id}:queue:{category} the ids of the unused ranked places of a category.
+
+    Edits never lock the trip: replacement places are claimed atomically from the
+    queues by a script, and a day is only written back if no other edit wrote it since
+    it was read (optimistic concurrency), otherwise the edit is retried.
+    """
+    def __init__(self, cache: RedisCache, places: PlaceStore, ttl: int):
+        self.cache = cache
+        self.places = places
+        self.ttl = ttl
+        self._claim_place = cache.redis_client.register_script(CLAIM_PLACE_SCRIPT)
+        self._commit_day = cache.redis_client.register_script(COMMIT_DAY_SCRIPT)
+
+    @staticmethod
+    def layout_key(trip_id: str) -> str:
+        return f"trip:{trip_id}:layout"
+
+    @staticmethod
+    def used_places_key(trip_id: str) -> str:
+        return f"trip:{trip_id}:used_places"
+
+    @staticmethod
+    def queue_key(trip_id: str, category: str) -> str:
+        return f"trip:{trip_id}:queue:{category}"
+
+    @staticmethod
+    def rankings_key(trip_id: str) -> str:
+        # whole rankings documents, written before the queues
+        return f"trip:{trip_id}:pre_ranked_places"
+
+    @staticmethod
+    def legacy_key(trip_id: str) -> str:
+        # whole TripResponse documents, written before the layout
+        return f"trip:{trip_id}:response"
+
+    @staticmethod
+    def day_locators(day_index: int, day: DayItinerary) -> Dict[str, str]:
+        locators = {}
+        for slot in TIME_SLOTS:
+            for i, activity in enumerate(getattr(day, f"{slot}_activities")):
+                locators[f"activity:{activity.id}"] = f"{day_index}:{slot}:{i}"
+        return locators
+
+    def _write_queues(self, pipeline, trip_id: str, rankings: PlaceRankings) -> None:
+        trip_fields = {}
+        for category, ranking in rankings.items():
+            queue_key = self.queue_key(trip_id, category)
+            pipeline.delete(queue_key)
+            place_ids = []
+            for item in ranking:
+                if isinstance(item, str):
+                    place_ids.append(item)
+                elif "name" not in item:
+                    # reference with the trip specific fields of the place
+                    place_id, fields = item["id"], {k: v for k, v in item.items() if k != "id"}
+                    trip_fields[f"trip_fields:{place_id}"] = encode_cache_value(fields)
+                    place_ids.append(place_id)
+                # places without an id can't be told apart once used
+            if place_ids:
+                pipeline.rpush(queue_key, *place_ids)
+                pipeline.expire(queue_key, self.ttl)
+        layout_key = self.layout_key(trip_id)
+        if trip_fields:
+            pipeline.hset(layout_key, mapping=trip_fields)
+        pipeline.hset(layout_key, "queues", encode_cache_value(list(rankings)))
+        pipeline.delete(self.rankings_key(trip_id))
+
+    async def save(self, trip_id: str, trip_response: TripResponse, rankings: Optional[PlaceRankings] = None) -> None:
+        """
+        Writes a whole trip, replacing any previous version, in one transaction.
+
+        Args:
+            trip_id: Id of the trip
+            trip_response: Trip to cache
+            rankings: Ids of the unused ranked places, the place queues are left as they are when None
+        """
+        async with self.cache.redis_client.pipeline(transaction=True) as pipeline:
+            self._write_trip(pipeline, trip_id, trip_response, rankings)
+            await pipeline.execute()
+
+    def _write_trip(self, pipeline, trip_id: str, trip_response: TripResponse, rankings: Optional[PlaceRankings]) -> None:
+        trip_dict = trip_response.dict()
+        itinerary_dict = trip_dict.pop("itinerary")
+        days = itinerary_dict.pop("days")
+
+        fields = {
+            "meta": encode_cache_value(trip_dict),
+            "itinerary": encode_cache_value(itinerary_dict),
+            "day_count": len(days),
+        }
+        used_place_ids = set()
+        for day_index, (day, day_dict) in enumerate(zip(trip_response.itinerary.days, days)):
+            fields[f"day:{day_index}"] = encode_cache_value(day_dict)
+            fields.update(self.day_locators(day_index, day))
+            used_place_ids.update(
+                a.place.id for a in day.morning_activities + day.afternoon_activities if a.place.id is not None
+            )
+
+        layout_key, used_key = self.layout_key(trip_id), self.used_places_key(trip_id)
+        pipeline.delete(layout_key, used_key, self.legacy_key(trip_id))
+        pipeline.hset(layout_key, mapping=fields)
+        if rankings is not None:
+            self._write_queues(pipeline, trip_id, rankings)
+        pipeline.expire(layout_key, self.ttl)
+        if used_place_ids:
+            pipeline.sadd(used_key, *used_place_ids)
+            pipeline.expire(used_key, self.ttl)
+
+    async def _migrate_legacy(self, trip_id: str) -> bool:
+        """
+        Moves a trip cached as a whole TripResponse document to the layout.
+        The legacy document is watched, so only one of concurrent migrations writes the
+        layout and none of them resets a layout an edit already wrote to.
+
+        Returns:
+            Whether the trip is now in the layout, moved by this or a concurrent call
+        """
+        legacy_key = self.legacy_key(trip_id)
+        async with self.cache.redis_client.pipeline(transaction=True) as pipeline:
+            await pipeline.watch(legacy_key)
+            cached_trip = await pipeline.get(legacy_key)
+            if cached_trip is None:
+                # never cached, or moved by a concurrent call meanwhile
+                return await pipeline.exists(self.layout_key(trip_id)) > 0
+            cached_data = decode_cache_value(cached_trip)
+            # Ensure required fields exist
+            cached_data.setdefault("trip_type", "place")
+            cached_data.setdefault("template_type", TemplateType.MODERATE.value)
+            cached_data.setdefault("id", trip_id)
+            cached_data.setdefault("is_group", False)
+            cached_data["id"] = cached_data["id"] or trip_id
+            pipeline.multi()
+            self._write_trip(pipeline, trip_id, TripResponse(**cached_data), None)
+            try:
+                await pipeline.execute()
+            except redis.WatchError:
+                logger.info(f"Cached trip {trip_id} was moved to the day layout concurrently")
+                return True
+        logger.info(f"Moved cached trip {trip_id} to the day layout")
+        return True
+
+    async def _migrate_rankings(self, trip_id: str) -> Optional[List[str]]:
+        """Moves the rankings document of a trip to place queues, returns their categories"""
+        cached_rankings = await self.cache.get(self.rankings_key(trip_id))
+        if cached_rankings is None:
+            return None
+        # legacy rankings may hold whole place documents, move them to the place store
+        rankings = await self.places.save(await self.places.load(decode_cache_value(cached_rankings)))
+        async with self.cache.redis_client.pipeline(transaction=True) as pipeline:
+            self._write_queues(pipeline, trip_id, rankings)
+            await pipeline.execute()
+        logger.info(f"Moved the pre-ranked places of trip {trip_id} to place queues")
+        return list(rankings)
+
+    async def load_day(self, trip_id: str, activity_id, with_queues: bool = False) -> Optional[DayEdit]:
+        """
+        Loads the day of an activity, in two round-trips whatever the length of the trip.
+
+        Args:
+            trip_id: Id of the trip
+            activity_id: Id of the activity to edit
+            with_queues: Move the legacy rankings to place queues if needed, so the
+                categories of the queues are always loaded
+
+        Returns:
+            None if the trip isn't cached, otherwise the day of the activity
+            (day_index and day are None when the trip has no such activity)
+        """
+        layout_key = self.layout_key(trip_id)
+        migrated = False
+        while True:
+            locator, day_count, cached_queues = await self.cache.redis_client.hmget(
+                layout_key, [f"activity:{activity_id}", "day_count", "queues"]
+            )
+            if day_count is not None:
+                break
+            if migrated or not await self._migrate_legacy(trip_id):
+                return None
+            migrated = True
+
+        # the queues are always known to the edits, which refresh their ttl
+        categories = decode_cache_value(cached_queues) if cached_queues is not None else None
+        if with_queues and categories is None:
+            categories = await self._migrate_rankings(trip_id)
+
+        if locator is None:
+            return DayEdit(trip_id, None, None, int(day_count), categories=categories)
+        day_index = int(locator.split(b":")[0])
+        cached_day, version = await self.cache.redis_client.hmget(
+            layout_key, [f"day:{day_index}", f"version:{day_index}"]
+        )
+        day = DayItinerary(**decode_cache_value(cached_day))
+        return DayEdit(trip_id, day_index, day, int(day_count), int(version or 0), categories)
+
+    async def reload_day(self, edit: DayEdit, activity_id) -> Optional[DayEdit]:
+        """
+        Reads again the day of an edit that lost a conflict, in one round-trip,
+        keeping the categories loaded with it.
+
+        Returns:
+            None if the trip isn't cached anymore, otherwise the day of the activity
+            (day_index and day are None when the activity was removed meanwhile)
+        """
+        locator, cached_day, version = await self.cache.redis_client.hmget(
+            self.layout_key(edit.trip_id),
+            [f"activity:{activity_id}", f"day:{edit.day_index}", f"version:{edit.day_index}"],
+        )
+        if cached_day is None:
+            return None
+        if locator is None:
+            return DayEdit(edit.trip_id, None, None, edit.day_count, categories=edit.categories)
+        if int(locator.split(b":")[0]) != edit.day_index:
+            # the whole trip was written again meanwhile
+            reloaded = await self.load_day(edit.trip_id, activity_id)
+            if reloaded is not None:
+                reloaded.categories = edit.categories
+            return reloaded
+        day = DayItinerary(**decode_cache_value(cached_day))
+        return DayEdit(edit.trip_id, edit.day_index, day, edit.day_count, int(version or 0), edit.categories)
+
+    async def claim_place(self, trip_id: str, categories: List[str]) -> Optional[Tuple[str, PlaceInfo]]:
+        """
+        Atomically takes the next unused place from the queues of the categories, in order,
+        and marks it used, so concurrent edits never get the same place.
+
+        Returns:
+            The category and the place, or None when the queues are exhausted
+        """
+        if not categories:
+            return None
+        used_key = self.used_places_key(trip_id)
+        keys = [used_key, self.layout_key(trip_id)]
+        keys.extend(self.queue_key(trip_id, category) for category in categories)
+        while True:
+            claimed = await self._claim_place(keys=keys, client=self.cache.redis_client)
+            if claimed is None:
+                return None
+            queue_index, place_id, cached_fields = int(claimed[0]), claimed[1].decode(), claimed[2]
+            category = categories[queue_index]
+            reference = {"id": place_id, **decode_cache_value(cached_fields)} if cached_fields else place_id
+            places = await self.places.load({category: [reference]})
+            if places[category]:
+                return category, places[category][0]
+            # the place document expired, drop the place
+            await self.cache.redis_client.srem(used_key, place_id)
+
+    async def release_place(self, trip_id: str, category: str, place_id: str) -> None:
+        """Gives back a claimed place that didn't make it into the itinerary, at the front of its queue"""
+        async with self.cache.redis_client.pipeline(transaction=True) as pipeline:
+            pipeline.srem(self.used_places_key(trip_id), place_id)
+            pipeline.lpush(self.queue_key(trip_id, category), place_id)
+            await pipeline.execute()
+
+    async def save_day(
+        self,
+        edit: DayEdit,
+        removed_activity_ids: List = (),
+        removed_place: Optional[Tuple[Optional[str], PlaceInfo]] = None,
+        added_place_id: Optional[str] = None,
+    ) -> Optional[dict]:
+        """
+        Writes back an edited day and its locators, unless another edit wrote the day
+        since it was loaded, and reads the rest of the itinerary in the same round-trip
+        for the response.
+
+        Args:
+            edit: The edited day
+            removed_activity_ids: Activities removed from the day
+            removed_place: Category and place that left the itinerary,
+                it goes back to the end of its queue when it has a category
+            added_place_id: Id of the place that joined the itinerary
+
+        Returns:
+            The whole itinerary as a dict, or None on a conflict with another edit
+        """
+        trip_id = edit.trip_id
+        layout_key, used_key = self.layout_key(trip_id), self.used_places_key(trip_id)
+        day_dict = edit.day.dict()
+        other_days = [f"day:{i}" for i in range(edit.day_count) if i != edit.day_index]
+
+        categories = list(edit.categories or [])
+        removed_category, removed = removed_place or (None, None)
+        removed_place_id = removed.id if removed is not None else None
+        requeued = removed_category is not None and removed_place_id is not None
+        removed_fields = b""
+        requeue_index = 0
+        if requeued:
+            if removed_category not in categories:
+                categories.append(removed_category)
+            # index in the 1-based KEYS of the script
+            requeue_index = 3 + categories.index(removed_category)
+            trip_fields = trip_place_fields(removed)
+            if trip_fields:
+                removed_fields = encode_cache_value(trip_fields)
+        keys = [layout_key, used_key, *[self.queue_key(trip_id, category) for category in categories]]
+        locators = self.day_locators(edit.day_index, edit.day)
+        args = [
+            edit.day_index,
+            edit.version,
+            self.ttl,
+            encode_cache_value(day_dict),
+            removed_place_id or "",
+            removed_fields,
+            requeue_index,
+            added_place_id or "",
+            len(locators),
+            *[item for locator in locators.items() for item in locator],
+            *[f"activity:{a}" for a in removed_activity_ids],
+        ]
+
+        async with self.cache.redis_client.pipeline(transaction=False) as pipeline:
+            if requeued:
+                # places of the initial itinerary have no shared document yet
+                pipeline.setex(self.places.key(removed_place_id), self.places.ttl, place_document(removed))
+            await self._commit_day(keys=keys, args=args, client=pipeline)
+            pipeline.hmget(layout_key, ["itinerary", *other_days])
+            *_, written, (cached_itinerary, *cached_days) = await pipeline.execute()
+        if not written:
+            logger.info(f"Day {edit.day_index} of trip {trip_id} changed since it was loaded")
+            return None
+
+        days = dict(zip(other_days, cached_days))
+        itinerary = decode_cache_value(cached_itinerary)
+        itinerary["days"] = [
+            day_dict if i == edit.day_index else decode_cache_value(days[f"day:{i}"])
+            for i in range(edit.day_count)
+        ]
+        return itinerary
+
+trip_store = TripStore(redis_cache, place_store, TRIP_CACHE_TTL)